@@ -13,6 +13,7 @@ This script:
 import os
 import sys
 import csv
+import shutil
 import time
 import numpy as np
 import copy
@@ -25,7 +26,7 @@ import genetic_algorithm as ga
 import ga_fitness
 import fuzzy_generator
 import vehicle
-import decoder
+import control_lut
 from utils import constants, load_path as lp
 
 
@@ -72,6 +73,31 @@ GA_STRATEGIES = {
     },
 }
 
+# Evaluates trained controllers through a control surface LUT of this grid resolution
+# (control_lut.py). None evaluates the fuzzy systems directly
+EVALUATION_LUT_RESOLUTION = None
+
+# Stopping criteria of every training run (genetic_algorithm.EarlyStopping), a strategy may override them.
+# None turns a criterion off, the run then stops after max_iterations
+EARLY_STOPPING = {
+    'stagnation_generations': None,
+    'variance_floor': None,
+    'time_budget': None,
+    'evaluation_budget': None,
+}
+
+# Processes evaluating the fitness of every training run (ga_fitness.make_evaluator), a strategy may
+# override it. Ignored by islands, they evaluate in their own process
+WORKERS = 1
+
+# GA state of every training run, saved every GAConfig.checkpoint_interval generations. An interrupted
+# benchmark resumes each run from its checkpoint, they are removed once the reports are written
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'checkpoints', 'benchmark')
+
+# Trains every strategy as this many islands in their own processes (genetic_algorithm.optimize_islands),
+# 1 runs the generational loop of train_ga_for_config
+ISLANDS = 1
+
 # ============================================================================
 # METRICS COLLECTION CLASS
 # ============================================================================
@@ -91,6 +117,8 @@ class BenchmarkMetrics:
         self.crashed = False
         self.idle = False
         self.max_iterations_reached = False
+        self.generations_completed = None
+        self.stop_reason = None
         self.collision_penalty = 0
         self.success_rate = 0
         self.efficiency_score = 0
@@ -109,6 +137,8 @@ class BenchmarkMetrics:
             'Crashed': int(self.crashed),
             'Idle': int(self.idle),
             'Max_Iterations_Reached': int(self.max_iterations_reached),
+            'Generations_Completed': self.generations_completed,
+            'Stop_Reason': self.stop_reason,
             'Collision_Penalty': round(self.collision_penalty, 2),
             'Success_Rate': round(self.success_rate, 4),
             'Efficiency_Score': round(self.efficiency_score, 4),
@@ -125,6 +155,8 @@ class BenchmarkRunner:
     def __init__(self):
         self.results = []
         self.summary_data = {}
+        # (strategy, path, training id) -> (generations completed, stop reason) of its GA run
+        self.training_stops = {}
         
     def run_full_benchmark(self):
         """Run complete benchmark for all paths and strategies"""
@@ -168,47 +200,56 @@ class BenchmarkRunner:
         
         self.evaluate_and_compare(best_solutions, paths_config)
         self.export_results()
+        shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
     
     def train_ga_for_config(self, strategy_name, config, path_name, road_matrix, training_id):
         """Train GA with specific strategy configuration"""
         print(f"\n  Training {training_id}/{config['num_trainings']} for {path_name} path...")
         
-        ga.road_matrix = road_matrix
-        ga.memory = {}
-        ga.POPULATION_SIZE = config['population_size']
-        ga.MAX_ITERATIONS = config['max_iterations']
-        ga.ELITISM_RATIO = config['elitism_ratio']
-        ga.TOURNAMENT_SIZE = config['tournament_size']
-        ga.MUTATION_RATE = config['mutation_rate']
-        ga.MUTATION_SPAN = config['mutation_span']
-        ga.MUTATION_GENOM_RATE = config['mutation_genom_rate']
+        if ISLANDS > 1:
+            result = ga.optimize_islands(ga.GAConfig.from_dict(dict(config, islands=ISLANDS)), road_matrix)
+            self.training_stops[strategy_name, path_name, training_id] = (config['max_iterations'], 'max_iterations')
+            print(f"  ✓ Training {training_id} completed! Fitness: {result.fitness:.4f}")
+            return result
+        
+        checkpoint = os.path.join(CHECKPOINT_DIR, f'{strategy_name}_{path_name}_{training_id}.npz')
+        run = ga.GARun(ga.GAConfig.from_dict({**EARLY_STOPPING, 'workers': WORKERS, **config}), road_matrix, checkpoint = checkpoint)
         
-        population = ga.init_population(config['population_size'])
+        stopping = ga.EarlyStopping(run)
+        population, completed = ga.resume_population(run, stopping)
         
-        for iteration in range(config['max_iterations']):
-            population.sort()
-            elites = int(population.size * config['elitism_ratio'])
-            new_population = [population[i] for i in range(0, elites)]
+        for iteration in range(completed, config['max_iterations']):
+            new_population = ga.get_elites(population, run.config)
+            elites = len(new_population)
+            offspring = []
             
-            for i in range((config['population_size'] - elites) // 2):
-                p1 = ga.select(population)
-                p2 = ga.select(population)
-                c1, c2 = ga.crossover(p1, p2)
-                c1 = ga.mutate(c1)
-                c2 = ga.mutate(c2)
-                c1.update_fitness()
-                c2.update_fitness()
-                new_population.append(c1)
-                new_population.append(c2)
+            pairs = (config['population_size'] - elites) // 2
+            parents = ga.select_parents(population, run, 2 * pairs)
+            for i in range(pairs):
+                p1, p2 = parents[2*i], parents[2*i + 1]
+                c1, c2 = ga.crossover(p1, p2, run)
+                c1 = ga.mutate(c1, run)
+                c2 = ga.mutate(c2, run)
+                offspring.append(c1)
+                offspring.append(c2)
+            ga.evaluate_population(offspring, run)
+            new_population.extend(offspring)
             
             population = np.array(new_population)
+            stopped = ga.end_generation(run, stopping, population, iteration + 1)
             best = ga.get_best_chromosome(population)
             avg_fitness = np.mean([c.fitness for c in population])
             
             if (iteration + 1) % 5 == 0:
                 print(f"    Gen {iteration+1:2d}/{config['max_iterations']}: Best={best.fitness:.4f} Avg={avg_fitness:.4f}")
+            if stopped:
+                break
         
-        result = ga.get_best_chromosome(population)
+        result = ga.best_result(population, run)
+        run.close()
+        self.training_stops[strategy_name, path_name, training_id] = (run.generations, run.stop_reason)
+        if run.stop_reason != 'max_iterations':
+            print(f"    Stopped after {run.generations} generations: {run.stop_reason}")
         print(f"  ✓ Training {training_id} completed! Fitness: {result.fitness:.4f}")
         return result
     
@@ -225,9 +266,9 @@ class BenchmarkRunner:
                 for idx, chromosome in enumerate(best_solutions[strategy_name][path_name]):
                     fitness = chromosome.fitness
                     
-                    memory = {}
+                    cache = ga_fitness.SensorCache()
                     car = vehicle.Car(constants.CAR_POS_X, constants.CAR_POS_Y, constants.CAR_ANGLE)
-                    dec = decoder.Decoder(chromosome.FSAngle, chromosome.FSVelocity, car)
+                    dec = control_lut.make_decoder(chromosome.FSAngle, chromosome.FSVelocity, car, EVALUATION_LUT_RESOLUTION)
                     
                     iteration = 0
                     past_pos = car.center_position()
@@ -239,7 +280,7 @@ class BenchmarkRunner:
                     
                     while iteration <= ga_fitness.MAX_ITERATIONS:
                         car.left_sensor_input, car.front_sensor_input, car.right_sensor_input = \
-                            ga_fitness.get_sensors(car, road_matrix, memory)
+                            ga_fitness.get_sensors(car, road_matrix, cache)
                         ds, drot = dec.get_movement_params()
                         car.update(ga_fitness.TIME_STEP, ds, drot)
                         
@@ -266,6 +307,7 @@ class BenchmarkRunner:
                             break
                     
                     metrics = BenchmarkMetrics(path_name, strategy_name, idx + 1)
+                    metrics.generations_completed, metrics.stop_reason = self.training_stops[strategy_name, path_name, idx + 1]
                     metrics.fitness_value = fitness
                     metrics.left_right_balance = left_right_balance / max(1, iteration)
                     metrics.total_distance = total_distance
@@ -0,0 +1,590 @@
+"""
+Performance Benchmarks for the Fuzzy Logic Vehicle GA Pipeline
+Micro-benchmarks for the hot paths of training, one sub-command per topic.
+
+Sub-commands:
+  fuzzy      - FuzzySystem.fit vs CompiledFuzzySystem and fit_batch, and the decoder step on both systems (per step cost, bit-identity check)
+  population - serial (FSAngle, FSVelocity).fit per chromosome vs PopulationFuzzySystem
+  decoder    - Decoder.get_movement_params with and without building the fuzzy_text introspection
+  memory     - bytes and allocated blocks per chromosome (FSAngle, FSVelocity), __dict__ vs __slots__ MFs and rules
+  sensors    - Car.get_sensors2 (pixel loop) vs get_sensors3 (NumPy ray chunks) on the sin / convex road
+  cache      - sensor cache hit rates of worker processes, one SensorCache per process vs one SharedSensorCache
+  evaluator  - wall clock of one generation's fitness, SerialEvaluator vs PoolEvaluator at several worker counts
+  simulation - evaluations per second of ga_fitness.evaluate vs the lockstep evaluate_batch, both on canonical sensors
+  pruning    - children evaluated to completion vs stopped at the worst elite / median fitness of their parents
+  steady     - generational vs steady-state GA on a worker pool, wall time and worker utilization
+  islands    - island model GA wall time and best fitness for K = 1 .. cores islands of the same total population
+  generation - GA bookkeeping per generation without evaluation, sort + deepcopy best vs fitness array argpartition / argmin
+
+Usage:
+  python benchmark_performance.py fuzzy --steps 20000
+  python benchmark_performance.py population --population 1000
+  python benchmark_performance.py decoder --steps 20000
+  python benchmark_performance.py memory --sizes 500 1000 1500
+  python benchmark_performance.py sensors --positions 2000 --max-range 350
+  python benchmark_performance.py cache --population 200 --workers 4
+  python benchmark_performance.py evaluator --population 200 --worker-counts 1 2 4 8
+  python benchmark_performance.py simulation --population 200
+  python benchmark_performance.py pruning --population 200
+  python benchmark_performance.py generation --population-sizes 100 1000 10000
+  python benchmark_performance.py steady --population 100 --generations 5 --workers 4
+  python benchmark_performance.py islands --population 1500 --generations 30 --island-counts 1 2 4 8
+"""
+
+import os
+import io
+import sys
+import gc
+import contextlib
+import copy
+import time
+import tracemalloc
+import pickle
+import argparse
+import random
+import multiprocessing
+import numpy as np
+
+import fuzzy
+import fuzzy_generator
+import decoder
+import vehicle
+import ga_fitness
+import genome
+import genetic_algorithm as ga
+from utils import constants, load_path as lp
+from utils.bench import random_road_cars, time_per_call
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+TRAINED_MODELS = {
+    'sin': os.path.join(RESULTS_DIR, 'sin', 'best_sin.pickle'),
+    'convex': os.path.join(RESULTS_DIR, 'convex', 'best_convex.pickle'),
+}
+
+# Decoder input order: left, right, front
+SENSOR_FUNCS = ['left_sensor', 'right_sensor', 'front_sensor']
+
+ROADS = {
+    'sin': lp.load_sin_params,
+    'convex': lp.load_convex_params,
+}
+
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def load_trained(path_name):
+    """Load trained (FSAngle, FSVelocity) pair of a path"""
+    with open(TRAINED_MODELS[path_name], 'rb') as f:
+        FSAngle, FSVelocity = pickle.load(f)
+    return FSAngle, FSVelocity
+
+def random_fuzzy_inputs(n, seed=0):
+    """(n, 3) decoder inputs, slightly wider than the MF ranges to hit both edges"""
+    rng = np.random.default_rng(seed)
+    high = np.array([fuzzy_generator.ALL_FUZZY_FUNCS[name]['right_boundary'] for name in SENSOR_FUNCS])
+    return rng.uniform(-0.1, 1.2, size=(n, len(SENSOR_FUNCS))) * high
+
+
+# ============================================================================
+# BENCHMARKS
+# ============================================================================
+
+def bench_fuzzy(args):
+    """Per step cost of FuzzySystem.fit vs its compiled form"""
+    print("\n" + "="*80)
+    print("FUZZY INFERENCE - FuzzySystem.fit vs CompiledFuzzySystem.evaluate vs fit_batch")
+    print("="*80)
+
+    inputs = random_fuzzy_inputs(args.steps)
+
+    print(f"\n{'Path':<8}{'System':<10}{'fit [us]':>12}{'compiled [us]':>16}{'speedup':>10}"
+          f"{'batch [us/row]':>16}{'speedup':>10}{'mismatches':>12}")
+    print("-" * 94)
+    for path_name in TRAINED_MODELS:
+        for name, system in zip(['angle', 'velocity'], load_trained(path_name)):
+            compiled = system.compile()
+
+            batch = system.fit_batch(inputs)
+            mismatches = 0
+            for x, batch_solution in zip(inputs, batch):
+                system.fit(x)
+                if system.solution != compiled.evaluate(x) or system.solution != batch_solution:
+                    mismatches += 1
+
+            fit_us = time_per_call(system.fit, inputs)
+            compiled_us = time_per_call(compiled.evaluate, inputs)
+            batch_us = time_per_call(system.fit_batch, [inputs]) / len(inputs)
+            print(f"{path_name:<8}{name:<10}{fit_us:>12.2f}{compiled_us:>16.2f}{fit_us/compiled_us:>9.1f}x"
+                  f"{batch_us:>16.3f}{fit_us/batch_us:>9.1f}x{mismatches:>12}")
+
+    # Decoder step: both systems on one input vector, fuzzified once when compiled
+    print(f"\n{'Path':<8}{'fit both [us]':>16}{'compiled [us]':>16}{'speedup':>10}{'mismatches':>12}")
+    print("-" * 62)
+    for path_name in TRAINED_MODELS:
+        systems = load_trained(path_name)
+        compiled = fuzzy.CompiledMultiOutputFuzzySystem(systems)
+
+        def fit_both(x):
+            for system in systems:
+                system.fit(x)
+            return [system.solution for system in systems]
+
+        mismatches = sum(fit_both(x) != compiled.evaluate(x) for x in inputs)
+        fit_us = time_per_call(fit_both, inputs)
+        compiled_us = time_per_call(compiled.evaluate, inputs)
+        print(f"{path_name:<8}{fit_us:>16.2f}{compiled_us:>16.2f}{fit_us/compiled_us:>9.1f}x{mismatches:>12}")
+
+
+def bench_population(args):
+    """One lockstep fuzzy step of a whole population vs serial evaluation"""
+    print("\n" + "="*80)
+    print(f"POPULATION FUZZY STEP - {args.population} chromosomes")
+    print("="*80)
+
+    random.seed(0)
+    members = [fuzzy_generator.build_random_fuzzy_system() for _ in range(args.population)]
+
+    start = time.perf_counter()
+    population = fuzzy.PopulationFuzzySystem(members)
+    build_time = time.perf_counter() - start
+
+    steps = max(1, args.steps // args.population)
+    serial_time = 0.0
+    population_time = 0.0
+    mismatches = 0
+    for step in range(steps):
+        X = random_fuzzy_inputs(args.population, seed=step)
+
+        start = time.perf_counter()
+        angles, velocities = population.evaluate(X)
+        population_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (FSAngle, FSVelocity), x, angle, velocity in zip(members, X, angles, velocities):
+            FSAngle.fit(x)
+            FSVelocity.fit(x)
+            if FSAngle.solution != angle or FSVelocity.solution != velocity:
+                mismatches += 1
+        serial_time += time.perf_counter() - start
+
+    print(f"\n  Build:                      {build_time*1e3:.1f} ms")
+    print(f"  Serial step:                {serial_time/steps*1e3:.2f} ms")
+    print(f"  Population step:            {population_time/steps*1e3:.2f} ms")
+    print(f"  Speedup:                    {serial_time/population_time:.1f}x")
+    print(f"  Mismatches:                 {mismatches}")
+
+
+def bench_decoder(args):
+    """Per step cost of the decoder in training (no text) vs on screen (fuzzy_text read every step)"""
+    print("\n" + "="*80)
+    print("DECODER STEP - headless vs fuzzy_text")
+    print("="*80)
+
+    # Decoder scales sensor readings by ALPHA, undo it to land on the same fuzzy inputs
+    sensors = random_fuzzy_inputs(args.steps) / decoder.ALPHA
+    car = vehicle.Car(constants.CAR_POS_X, constants.CAR_POS_Y, constants.CAR_ANGLE)
+
+    def headless_step(x):
+        car.left_sensor_input, car.right_sensor_input, car.front_sensor_input = x
+        dec.get_movement_params()
+
+    def text_step(x):
+        car.left_sensor_input, car.right_sensor_input, car.front_sensor_input = x
+        dec.get_movement_params()
+        dec.fuzzy_text
+
+    print(f"\n{'Path':<8}{'headless [us]':>16}{'fuzzy_text [us]':>18}{'text share':>13}")
+    print("-" * 55)
+    for path_name in TRAINED_MODELS:
+        dec = decoder.Decoder(*load_trained(path_name), car)
+        headless_us = time_per_call(headless_step, sensors)
+        text_us = time_per_call(text_step, sensors)
+        print(f"{path_name:<8}{headless_us:>16.2f}{text_us:>18.2f}{(text_us - headless_us)/text_us:>12.0%}")
+
+
+class LegacyMFInput:
+    # MFInput as it was before fuzzy.Compact: fields in a per-instance __dict__
+    def __init__(self, name, xs, ys):
+        self.name = name
+        self.points = np.array(list(zip(xs, ys)))
+        self.size = xs.size
+        self.x0 = None
+        self.mi = None
+
+class LegacyMFOutput:
+    # MFOutput before fuzzy.Compact
+    def __init__(self, name, xs, ys):
+        self.name = name
+        self.points = np.array(list(zip(xs, ys)))
+        self.size = xs.size
+        self.center = xs[ys == 1].sum() / np.count_nonzero(ys == 1)
+        self.mi = 0
+
+class LegacyRule:
+    # Rule before fuzzy.Compact, its antecedent is the object ndarray it is given
+    def __init__(self, inputs, output, operator = fuzzy.Logic.AND):
+        self.inputs = inputs
+        self.output = output
+        self.operator = operator
+
+@contextlib.contextmanager
+def legacy_classes():
+    """fuzzy_generator builds MFs and rules of the Legacy classes inside the block"""
+    classes = fuzzy.MFInput, fuzzy.MFOutput, fuzzy.Rule
+    fuzzy.MFInput, fuzzy.MFOutput, fuzzy.Rule = LegacyMFInput, LegacyMFOutput, LegacyRule
+    try:
+        yield
+    finally:
+        fuzzy.MFInput, fuzzy.MFOutput, fuzzy.Rule = classes
+
+def population_memory(size):
+    """(bytes, allocated blocks) of size random chromosomes"""
+    random.seed(0)
+    gc.collect()
+    tracemalloc.start()
+    members = [fuzzy_generator.build_random_fuzzy_system() for _ in range(size)]
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del members
+    return total, blocks
+
+def bench_memory(args):
+    """Memory held by the fuzzy systems of a population, __dict__ classes (before) vs __slots__ (after)"""
+    print("\n" + "="*80)
+    print("POPULATION MEMORY - fuzzy systems of every chromosome, __dict__ MFs and rules vs __slots__")
+    print("="*80)
+
+    print(f"\n{'Population':>10}{'Before [MB]':>13}{'After [MB]':>12}{'Before B/chr':>14}{'After B/chr':>13}"
+          f"{'Blocks before':>15}{'Blocks after':>14}{'Saved':>8}")
+    print("-" * 99)
+    for size in args.sizes:
+        with legacy_classes():
+            before, before_blocks = population_memory(size)
+        after, after_blocks = population_memory(size)
+        print(f"{size:>10}{before/2**20:>13.2f}{after/2**20:>12.2f}{before/size:>14.0f}{after/size:>13.0f}"
+              f"{before_blocks/size:>15.0f}{after_blocks/size:>14.0f}{1 - after/before:>8.1%}")
+
+    # __slots__ only drops the per-object __dict__, every MF still owns its points ndarray
+    FSAngle, FSVelocity = fuzzy_generator.build_random_fuzzy_system()
+    mfs = [mf for fuzzy_input in FSAngle.inputs for mf in fuzzy_input.inputs]
+    mfs += list(FSAngle.output.outputs) + list(FSVelocity.output.outputs)
+    points = sum(sys.getsizeof(mf.points) for mf in mfs)
+    print(f"\nUnchanged per MF: its own points ndarray. {len(mfs)} MFs per chromosome hold "
+          f"{points:.0f} bytes of points ({points/len(mfs):.0f} per MF, header included)")
+
+
+def bench_sensors(args):
+    """Cost of one sensor reading (three rays) on the road matrices"""
+    print("\n" + "="*80)
+    print("SENSORS - get_sensors2 vs get_sensors3")
+    print("="*80)
+
+    print(f"\n{'Road':<8}{'sensor2 [us]':>14}{'sensor3 [us]':>14}{'speedup':>10}{'mismatches':>12}"
+          f"{'capped [us]':>13}{'capped rays':>13}")
+    print("-" * 84)
+    for road_name, load in ROADS.items():
+        _, road_matrix = load()
+        cars = random_road_cars(road_matrix, args.positions)
+
+        mismatches = 0
+        capped = 0
+        for car in cars:
+            readings = car.get_sensors3(road_matrix)
+            if tuple(float(x) for x in car.get_sensors2(road_matrix)) != readings:
+                mismatches += 1
+            capped += sum(x > args.max_range for x in readings)
+
+        sensor2_us = time_per_call(lambda car: car.get_sensors2(road_matrix), cars, repeat=1)
+        sensor3_us = time_per_call(lambda car: car.get_sensors3(road_matrix), cars)
+        capped_us = time_per_call(lambda car: car.get_sensors3(road_matrix, args.max_range), cars)
+        print(f"{road_name:<8}{sensor2_us:>14.1f}{sensor3_us:>14.1f}{sensor2_us/sensor3_us:>9.1f}x{mismatches:>12}"
+              f"{capped_us:>13.1f}{capped:>13}")
+
+
+def init_cache_worker(road_matrix, cache):
+    global worker_road_matrix, worker_cache
+    worker_road_matrix = road_matrix
+    worker_cache = cache if cache is not None else ga_fitness.SensorCache()
+
+def evaluate_with_cache(members):
+    worker_cache.reset_stats()
+    for FSAngle, FSVelocity in members:
+        ga_fitness.evaluate(FSAngle, FSVelocity, worker_road_matrix, worker_cache)
+    return worker_cache.hits, worker_cache.misses
+
+def bench_cache(args):
+    """Sensor cache hit rates of a population evaluated by several worker processes"""
+    print("\n" + "="*80)
+    print(f"SENSOR CACHE - {args.population} chromosomes x 2 generations on {args.workers} workers")
+    print("="*80)
+
+    random.seed(0)
+    members = [fuzzy_generator.build_random_fuzzy_system() for _ in range(args.population)]
+    chunks = [members[i::args.workers] for i in range(args.workers)]
+
+    print(f"\n{'Road':<8}{'Cache':<10}{'Generation':>11}{'Hits':>10}{'Misses':>10}{'Hit rate':>10}{'Time [s]':>10}")
+    print("-" * 69)
+    for road_name, load in ROADS.items():
+        _, road_matrix = load()
+        for cache_name in ['process', 'shared']:
+            cache = ga_fitness.SharedSensorCache(road_matrix) if cache_name == 'shared' else None
+            with multiprocessing.Pool(args.workers, init_cache_worker, (road_matrix, cache)) as pool:
+                for generation in range(2):
+                    start = time.perf_counter()
+                    hits, misses = np.sum(pool.map(evaluate_with_cache, chunks), axis=0)
+                    elapsed = time.perf_counter() - start
+                    print(f"{road_name:<8}{cache_name:<10}{generation + 1:>11}{hits:>10}{misses:>10}"
+                          f"{hits/(hits + misses):>10.1%}{elapsed:>10.2f}")
+            if cache is not None:
+                cache.close()
+
+
+def bench_evaluator(args):
+    """Fitness of one generation on the serial and the process pool evaluators"""
+    print("\n" + "="*80)
+    print(f"FITNESS EVALUATION - {args.population} chromosomes, {os.cpu_count()} CPUs")
+    print("="*80)
+
+    random.seed(0)
+    members = [fuzzy_generator.build_random_fuzzy_system() for _ in range(args.population)]
+    _, road_matrix = lp.load_sin_params()
+
+    evaluators = [('serial', lambda: ga_fitness.SerialEvaluator(road_matrix))]
+    for workers in args.worker_counts:
+        evaluators.append((f'pool x{workers}', lambda workers=workers: ga_fitness.PoolEvaluator(road_matrix, workers)))
+
+    print(f"\n{'Evaluator':<12}{'Time [s]':>10}{'Speedup':>10}{'Same as serial':>16}")
+    print("-" * 48)
+    serial_time = None
+    reference = None
+    for name, make in evaluators:
+        evaluator = make()
+        start = time.perf_counter()
+        fitness = evaluator(members)
+        elapsed = time.perf_counter() - start
+        evaluator.close()
+
+        serial_time = serial_time or elapsed
+        reference = reference or fitness
+        same = 'yes' if fitness == reference else 'NO'
+        print(f"{name:<12}{elapsed:>10.2f}{serial_time/elapsed:>9.2f}x{same:>16}")
+
+
+def bench_simulation(args):
+    """Scalar simulation per chromosome vs lockstep simulation of the whole population"""
+    print("\n" + "="*80)
+    print(f"SIMULATION - {args.population} chromosomes, evaluate vs evaluate_batch")
+    print("="*80)
+
+    random.seed(0)
+    members = [fuzzy_generator.build_random_fuzzy_system() for _ in range(args.population)]
+
+    print(f"\n{'Road':<8}{'scalar [eval/s]':>17}{'batch [eval/s]':>16}{'speedup':>10}{'mismatches':>12}")
+    print("-" * 63)
+    for road_name, load in ROADS.items():
+        _, road_matrix = load()
+
+        start = time.perf_counter()
+        scalar = [ga_fitness.evaluate(FSAngle, FSVelocity, road_matrix, ga_fitness.CanonicalSensorCache(road_matrix))
+                  for FSAngle, FSVelocity in members]
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = ga_fitness.evaluate_batch(members, road_matrix)
+        batch_time = time.perf_counter() - start
+
+        mismatches = sum(a != b for a, b in zip(scalar, batch))
+        print(f"{road_name:<8}{len(members)/scalar_time:>17.1f}{len(members)/batch_time:>16.1f}"
+              f"{scalar_time/batch_time:>9.1f}x{mismatches:>12}")
+
+
+def bench_pruning(args):
+    """Time saved by early abort of children that cannot beat a bound from their parents"""
+    print("\n" + "="*80)
+    print(f"PRUNING - {args.population} parents, {args.population} children")
+    print("="*80)
+
+    random.seed(0)
+    parents = [fuzzy_generator.build_random_fuzzy_system() for _ in range(args.population)]
+    children = [fuzzy_generator.build_random_fuzzy_system() for _ in range(args.population)]
+
+    print(f"\n{'Road':<8}{'Bound':<10}{'Value':>9}{'Pruned':>9}{'Skipped steps':>15}{'Exact [s]':>11}{'Pruned [s]':>12}"
+          f"{'Saved':>8}{'Errors':>8}")
+    print("-" * 90)
+    for road_name, load in ROADS.items():
+        _, road_matrix = load()
+        evaluator = ga_fitness.SerialEvaluator(road_matrix, ga_fitness.SensorCache(0))
+        parent_fitness = np.sort(evaluator(parents))
+
+        start = time.perf_counter()
+        exact = evaluator(children)
+        exact_time = time.perf_counter() - start
+
+        bounds = {
+            'elite': parent_fitness[max(int(len(parents) * 0.05), 1) - 1],
+            'median': np.percentile(parent_fitness, 50),
+        }
+        for bound_name, bound in bounds.items():
+            start = time.perf_counter()
+            fitness = evaluator(children, bound)
+            pruned_time = time.perf_counter() - start
+
+            stats = ga_fitness.pruning_stats(fitness)
+            # Pruned values must be lower bounds of fitness values above the bound, the rest exact
+            errors = sum((f > e or e <= bound) if isinstance(f, ga_fitness.Pruned) else f != e
+                         for f, e in zip(fitness, exact))
+            print(f"{road_name:<8}{bound_name:<10}{bound:>9.2f}{stats['pruned']:>9}{stats['skipped_steps']:>15}"
+                  f"{exact_time:>11.2f}{pruned_time:>12.2f}{1 - pruned_time/exact_time:>8.0%}{errors:>8}")
+
+
+def legacy_best_chromosome(population):
+    """get_best_chromosome before the fitness array, a deepcopy per improvement"""
+    result = None
+    for chromosome in population:
+        if result is None or chromosome < result:
+            result = copy.deepcopy(chromosome)
+    return result
+
+def scored_population(templates, size, rng):
+    """size decoded chromosomes of the template genomes with random fitness"""
+    population = []
+    for i in range(size):
+        c = ga.Chromosome.from_genome(templates[i % len(templates)], rng.random())
+        c.get_systems()
+        population.append(c)
+    return np.array(population)
+
+def bench_generation(args):
+    """Per generation cost of elitism, best tracking and breeding, without fitness evaluation.
+    Outputs kept checks that mutation and breeding leave the output genes bit-identical"""
+    print("\n" + "="*80)
+    print("GENERATION OVERHEAD - elitism and best chromosome, fitness evaluation excluded")
+    print("="*80)
+
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    templates = genome.random_genomes(100)
+    _, road_matrix = ROADS['sin']()
+    outputs = ~genome.GENE_EVOLVED
+    parent_outputs = {genes[outputs].tobytes() for genes in templates}
+    mutated = genome.mutate(templates, 1.0, 1.0, 3, rng)
+    mutation_kept = np.array_equal(mutated[:, outputs], templates[:, outputs])
+
+    print(f"\n{'Population':>10}{'Sort+deepcopy [ms]':>20}{'Array [ms]':>12}{'Speedup':>9}{'Breeding [ms]':>15}{'Same best':>11}{'Outputs kept':>14}")
+    print("-" * 91)
+    for size in args.population_sizes:
+        config = ga.GAConfig(population_size=size, seed=0)
+        run = ga.GARun(config, road_matrix)
+        legacy_time = array_time = breed_time = float('inf')
+        for _ in range(3):
+            population = scored_population(templates, size, rng)
+
+            start = time.perf_counter()
+            fitness = ga.population_fitness(population)
+            elites = ga.get_elites(population, config, fitness)
+            best = ga.get_best_chromosome(population)
+            array_time = min(array_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            children = ga.next_generation(population, run, fitness)
+            breed_time = min(breed_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            population.sort()
+            legacy_elites = [population[i] for i in range(int(population.size * config.elitism_ratio))]
+            legacy = legacy_best_chromosome(population)
+            legacy_time = min(legacy_time, time.perf_counter() - start)
+        run.close()
+
+        kept = mutation_kept and all(c.genome[outputs].tobytes() in parent_outputs for c in children)
+        same = legacy.fitness == best.fitness and [c.fitness for c in legacy_elites] == [c.fitness for c in elites]
+        print(f"{size:>10}{legacy_time*1e3:>20.2f}{array_time*1e3:>12.2f}{legacy_time/array_time:>8.1f}x"
+              f"{breed_time*1e3:>15.2f}{str(same):>11}{str(kept):>14}")
+
+
+def bench_steady(args):
+    """Generational vs steady-state GA with the same number of evaluations on one PoolEvaluator size"""
+    print("\n" + "="*80)
+    print(f"STEADY STATE - population {args.population}, {args.generations} generations, {args.workers} workers")
+    print("="*80)
+
+    print(f"\n{'Road':<8}{'Mode':<14}{'Wall [s]':>10}{'Utilization':>13}{'Best fitness':>14}")
+    print("-" * 59)
+    for road_name, load in ROADS.items():
+        _, road_matrix = load()
+        for mode, steady_state in (('generational', False), ('steady state', True)):
+            config = ga.GAConfig(population_size=args.population, max_iterations=args.generations,
+                                 workers=args.workers, steady_state=steady_state, seed=0)
+            run = ga.GARun(config, road_matrix, evaluator=ga_fitness.PoolEvaluator(road_matrix, args.workers))
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                best = ga.optimize(run)
+            wall_time = time.perf_counter() - start
+            run.evaluator.close()
+            print(f"{road_name:<8}{mode:<14}{wall_time:>10.2f}{run.utilization:>13.1%}{best.fitness:>14.4f}")
+
+
+def bench_islands(args):
+    """Island model scaling: same total population and generations split over K island processes"""
+    print("\n" + "="*80)
+    print(f"ISLANDS - population {args.population}, {args.generations} generations, {os.cpu_count()} cores")
+    print("="*80)
+
+    print(f"\n{'Road':<8}{'Islands':>8}{'Wall [s]':>10}{'Speedup':>9}{'Efficiency':>12}{'Best fitness':>14}")
+    print("-" * 61)
+    for road_name, load in ROADS.items():
+        _, road_matrix = load()
+        base_time = None
+        for islands in args.island_counts:
+            config = ga.GAConfig(population_size=args.population, max_iterations=args.generations,
+                                 islands=islands, seed=0)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                if islands > 1:
+                    best = ga.optimize_islands(config, road_matrix)
+                else:
+                    run = ga.GARun(config, road_matrix)
+                    best = ga.optimize(run)
+                    run.close()
+            wall_time = time.perf_counter() - start
+            base_time = base_time or wall_time
+            print(f"{road_name:<8}{islands:>8}{wall_time:>10.2f}{base_time/wall_time:>8.2f}x"
+                  f"{base_time/wall_time/islands:>12.0%}{best.fitness:>14.4f}")
+
+
+BENCHMARKS = {
+    'fuzzy': bench_fuzzy,
+    'population': bench_population,
+    'decoder': bench_decoder,
+    'memory': bench_memory,
+    'sensors': bench_sensors,
+    'cache': bench_cache,
+    'evaluator': bench_evaluator,
+    'simulation': bench_simulation,
+    'pruning': bench_pruning,
+    'generation': bench_generation,
+    'steady': bench_steady,
+    'islands': bench_islands,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=list(BENCHMARKS.keys()), help='Benchmark to run')
+    parser.add_argument('--steps', type=int, default=20000, help='Number of evaluated input vectors')
+    parser.add_argument('--population', type=int, default=1000, help='Population size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 1500], help='Population sizes (memory)')
+    parser.add_argument('--population-sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Population sizes (generation)')
+    parser.add_argument('--generations', type=int, default=5, help='GA generations (steady)')
+    parser.add_argument('--island-counts', type=int, nargs='+', default=list(range(1, os.cpu_count() + 1)), help='Island counts (islands)')
+    parser.add_argument('--positions', type=int, default=2000, help='Random road positions (sensors)')
+    parser.add_argument('--max-range', type=int, default=350, help='Sensor range cap in pixels (sensors)')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes (cache)')
+    parser.add_argument('--worker-counts', type=int, nargs='+', default=[1, 2, 4, 8], help='Pool sizes (evaluator)')
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
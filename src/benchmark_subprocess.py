@@ -36,7 +36,7 @@ import ga_fitness
 from utils import load_path as lp
 from utils import constants
 import vehicle
-import decoder
+import control_lut
 
 
 # ============================================================================
@@ -84,11 +84,33 @@ GA_STRATEGIES = {
 
 PATHS = ['convex', 'sin']
 
+# Evaluates trained controllers through a control surface LUT of this grid resolution
+# (control_lut.py). None evaluates the fuzzy systems directly
+EVALUATION_LUT_RESOLUTION = None
+
+# Stopping criteria of every training run (genetic_algorithm.EarlyStopping), a strategy may override them.
+# None turns a criterion off, the run then stops after max_iterations
+EARLY_STOPPING = {
+    'stagnation_generations': None,
+    'variance_floor': None,
+    'time_budget': None,
+    'evaluation_budget': None,
+}
+
+# Processes evaluating the fitness of every training run (ga_fitness.make_evaluator), a strategy may
+# override it
+WORKERS = 1
+
+# GA state of every training run, saved every GAConfig.checkpoint_interval generations. An interrupted
+# benchmark resumes each run from its checkpoint, they are removed once the reports are written
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'checkpoints', 'benchmark_subprocess')
+
 # Fieldnames for CSV
 DETAILED_FIELDNAMES = [
     'timestamp', 'strategy', 'path', 'run_id',
     'population_size', 'max_iterations', 'elitism_ratio',
     'mutation_rate', 'mutation_span', 'mutation_genom_rate', 'tournament_size',
+    'generations_completed', 'stop_reason',
     'fitness_value', 'total_distance', 'iterations_completed',
     'crashed', 'idle', 'collision_penalty', 'success_rate', 'efficiency_score',
     'left_right_balance', 'steering_stability',
@@ -135,6 +157,10 @@ class BenchmarkMetrics:
         self.mutation_genom_rate = 0.0
         self.tournament_size = 0
         
+        # Generations the GA ran and why it stopped (genetic_algorithm.EarlyStopping)
+        self.generations_completed = 0
+        self.stop_reason = None
+        
         # Results from GA training
         self.fitness_value = None
         self.training_time = 0.0
@@ -164,6 +190,8 @@ class BenchmarkMetrics:
             'mutation_span': self.mutation_span,
             'mutation_genom_rate': round(self.mutation_genom_rate, 4),
             'tournament_size': self.tournament_size,
+            'generations_completed': self.generations_completed,
+            'stop_reason': self.stop_reason,
             'fitness_value': round(self.fitness_value, 6) if self.fitness_value else None,
             'total_distance': round(self.total_distance, 2),
             'iterations_completed': self.iterations_completed,
@@ -240,6 +268,7 @@ class BenchmarkRunner:
         
         self.calculate_summary()
         self.export_all_reports()
+        shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
     
     def _load_path_matrix(self, path_name):
         """Load road matrix for path"""
@@ -264,8 +293,11 @@ class BenchmarkRunner:
         
         # Train GA
         start_time = time.time()
-        best_chromosome = self._train_ga(strategy_config, road_matrix)
+        checkpoint = os.path.join(CHECKPOINT_DIR, f'{strategy_name}_{path_name}_{run_id}.npz')
+        best_chromosome, run = self._train_ga(strategy_config, road_matrix, checkpoint)
         metrics.training_time = time.time() - start_time
+        metrics.generations_completed = run.generations
+        metrics.stop_reason = run.stop_reason
         metrics.fitness_value = best_chromosome.fitness
         
         print(f"  ✓ Training completed in {metrics.training_time:.2f}s | Fitness: {metrics.fitness_value:.6f}")
@@ -275,57 +307,58 @@ class BenchmarkRunner:
         
         return metrics
     
-    def _train_ga(self, config, road_matrix):
-        """Train genetic algorithm with given configuration"""
-        # Set global GA parameters
-        ga.road_matrix = road_matrix
-        ga.memory = {}
-        ga.POPULATION_SIZE = config['population_size']
-        ga.MAX_ITERATIONS = config['max_iterations']
-        ga.ELITISM_RATIO = config['elitism_ratio']
-        ga.TOURNAMENT_SIZE = config['tournament_size']
-        ga.MUTATION_RATE = config['mutation_rate']
-        ga.MUTATION_SPAN = config['mutation_span']
-        ga.MUTATION_GENOM_RATE = config['mutation_genom_rate']
-        
-        # Initialize population
-        population = ga.init_population(config['population_size'])
+    def _train_ga(self, config, road_matrix, checkpoint = None):
+        """Train genetic algorithm with given configuration, resuming from its checkpoint file.
+        Returns the best chromosome and the closed GARun (generations, stop_reason)"""
+        # GA run of this configuration
+        run = ga.GARun(ga.GAConfig.from_dict({**EARLY_STOPPING, 'workers': WORKERS, **config}), road_matrix, checkpoint = checkpoint)
+        
+        # Initialize population, or resume it from the checkpoint
+        stopping = ga.EarlyStopping(run)
+        population, completed = ga.resume_population(run, stopping)
         
         # GA loop
-        for iteration in range(config['max_iterations']):
-            population.sort()
-            
+        for iteration in range(completed, config['max_iterations']):
             # Elitism
-            elites_count = int(len(population) * config['elitism_ratio'])
-            new_population = [population[i] for i in range(elites_count)]
+            new_population = ga.get_elites(population, run.config)
+            elites_count = len(new_population)
+            offspring = []
             
             # Generate offspring
-            for _ in range((config['population_size'] - elites_count) // 2):
-                p1 = ga.select(population)
-                p2 = ga.select(population)
-                c1, c2 = ga.crossover(p1, p2)
-                c1 = ga.mutate(c1)
-                c2 = ga.mutate(c2)
-                c1.update_fitness()
-                c2.update_fitness()
-                new_population.append(c1)
-                new_population.append(c2)
+            pairs = (config['population_size'] - elites_count) // 2
+            parents = ga.select_parents(population, run, 2 * pairs)
+            for i in range(pairs):
+                p1, p2 = parents[2*i], parents[2*i + 1]
+                c1, c2 = ga.crossover(p1, p2, run)
+                c1 = ga.mutate(c1, run)
+                c2 = ga.mutate(c2, run)
+                offspring.append(c1)
+                offspring.append(c2)
+            ga.evaluate_population(offspring, run)
+            new_population.extend(offspring)
             
             population = ga.np.array(new_population)
+            stopped = ga.end_generation(run, stopping, population, iteration + 1)
             
             best = ga.get_best_chromosome(population)
             if (iteration + 1) % 5 == 0 or iteration == config['max_iterations'] - 1:
                 avg_fitness = ga.np.mean([c.fitness for c in population])
                 print(f"    Gen {iteration+1:3d}/{config['max_iterations']}: Best={best.fitness:.6f} Avg={avg_fitness:.6f}")
+            if stopped:
+                break
         
-        return ga.get_best_chromosome(population)
+        result = ga.best_result(population, run)
+        run.close()
+        if run.stop_reason != 'max_iterations':
+            print(f"    Stopped after {run.generations} generations: {run.stop_reason}")
+        return result, run
     
     def _evaluate_vehicle_performance(self, chromosome, road_matrix, metrics):
         """Evaluate trained chromosome vehicle performance"""
         car = vehicle.Car(constants.CAR_POS_X, constants.CAR_POS_Y, constants.CAR_ANGLE)
-        dec = decoder.Decoder(chromosome.FSAngle, chromosome.FSVelocity, car)
+        dec = control_lut.make_decoder(chromosome.FSAngle, chromosome.FSVelocity, car, EVALUATION_LUT_RESOLUTION)
         
-        memory = {}
+        cache = ga_fitness.SensorCache()
         iteration = 0
         total_distance = 0
         left_distances = []
@@ -336,7 +369,7 @@ class BenchmarkRunner:
         
         while iteration < ga_fitness.MAX_ITERATIONS:
             car.left_sensor_input, car.front_sensor_input, car.right_sensor_input = \
-                ga_fitness.get_sensors(car, road_matrix, memory)
+                ga_fitness.get_sensors(car, road_matrix, cache)
             
             left_distances.append(float(car.left_sensor_input))
             right_distances.append(float(car.right_sensor_input))
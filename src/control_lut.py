@@ -0,0 +1,183 @@
+"""
+Control Surface Lookup Table
+A trained controller is a fixed function (left, right, front) -> (angle, velocity) of the
+decoder inputs. ControlSurfaceLUT samples both fuzzy systems once on a dense grid over the
+input ranges of fuzzy_generator.ALL_FUZZY_FUNCS and answers queries with trilinear
+interpolation, which replaces two full fuzzy inferences per simulation step.
+
+The grid covers every MF breakpoint of the controller. Outside of the grid all memberships
+are constant, so clamped queries stay exact there.
+
+Usage:
+  python control_lut.py --polygon sin --resolutions 16 32 64 128 --save 64
+"""
+
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+
+import decoder
+import fuzzy_generator
+
+
+# Decoder input order (Decoder.FSInput)
+INPUT_FUNCS = ['left_sensor', 'right_sensor', 'front_sensor']
+
+DEFAULT_RESOLUTION = 64
+ERROR_SAMPLES = 20000
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def model_path(polygon):
+    """Trained (FSAngle, FSVelocity) pickle of a polygon"""
+    return os.path.join(RESULTS_DIR, polygon, f'best_{polygon}.pickle')
+
+def lut_path(model_filename):
+    """LUT file stored next to a model pickle"""
+    return os.path.splitext(model_filename)[0] + '_lut.npz'
+
+def input_extent(FSAngle):
+    """Input ranges of ALL_FUZZY_FUNCS, widened to every MF breakpoint of the controller"""
+    lows = []
+    highs = []
+    for name, fuzzy_input in zip(INPUT_FUNCS, FSAngle.inputs):
+        xs = np.concatenate([mf.points[:, 0] for mf in fuzzy_input])
+        lows.append(min(fuzzy_generator.ALL_FUZZY_FUNCS[name]['left_boundary'], xs.min()))
+        highs.append(max(fuzzy_generator.ALL_FUZZY_FUNCS[name]['right_boundary'], xs.max()))
+    return np.array(lows, dtype=float), np.array(highs, dtype=float)
+
+
+class ControlSurfaceLUT:
+    """Angle and velocity surfaces of a trained controller sampled on a regular grid"""
+
+    def __init__(self, lows, highs, angle, velocity):
+        self.lows = np.asarray(lows, dtype=float)
+        self.highs = np.asarray(highs, dtype=float)
+        self.angle = np.asarray(angle, dtype=float)
+        self.velocity = np.asarray(velocity, dtype=float)
+        self.shape = self.angle.shape
+        self.steps = (self.highs - self.lows) / (np.array(self.shape) - 1)
+
+        # Flat Python copies for the scalar query path
+        self._angle = self.angle.ravel().tolist()
+        self._velocity = self.velocity.ravel().tolist()
+        self._lows = self.lows.tolist()
+        self._steps = self.steps.tolist()
+        self._last = [n - 2 for n in self.shape]
+        n1, n2 = self.shape[1], self.shape[2]
+        self._corners = (0, 1, n2, n2 + 1, n1*n2, n1*n2 + 1, n1*n2 + n2, n1*n2 + n2 + 1)
+
+    @classmethod
+    def build(cls, FSAngle, FSVelocity, resolution=DEFAULT_RESOLUTION):
+        """Sample both fuzzy systems on resolution points per input (int or one per input)"""
+        lows, highs = input_extent(FSAngle)
+        shape = tuple(int(n) for n in np.broadcast_to(resolution, lows.shape))
+        axes = [np.linspace(low, high, n) for low, high, n in zip(lows, highs, shape)]
+        grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+        angle = FSAngle.fit_batch(grid).reshape(shape)
+        velocity = FSVelocity.fit_batch(grid).reshape(shape)
+        return cls(lows, highs, angle, velocity)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(data['lows'], data['highs'], data['angle'], data['velocity'])
+
+    def save(self, filename):
+        np.savez_compressed(filename, lows=self.lows, highs=self.highs, angle=self.angle, velocity=self.velocity)
+
+    def _cell(self, axis, x):
+        # Grid cell index and position inside the cell of one (clamped) input
+        u = (x - self._lows[axis]) / self._steps[axis]
+        i = min(max(int(u), 0), self._last[axis])
+        return i, min(max(u - i, 0.0), 1.0)
+
+    def _interpolate(self, grid, base, fx, fy, fz):
+        c000, c001, c010, c011, c100, c101, c110, c111 = [grid[base + offset] for offset in self._corners]
+        c00 = c000 + (c001 - c000)*fz
+        c01 = c010 + (c011 - c010)*fz
+        c10 = c100 + (c101 - c100)*fz
+        c11 = c110 + (c111 - c110)*fz
+        c0 = c00 + (c01 - c00)*fy
+        c1 = c10 + (c11 - c10)*fy
+        return c0 + (c1 - c0)*fx
+
+    def predict(self, x0s):
+        """(angle, velocity) for one decoder input vector (left, right, front)"""
+        (i, fx), (j, fy), (k, fz) = [self._cell(axis, float(x)) for axis, x in enumerate(x0s)]
+        base = (i*self.shape[1] + j)*self.shape[2] + k
+        return self._interpolate(self._angle, base, fx, fy, fz), self._interpolate(self._velocity, base, fx, fy, fz)
+
+    def predict_batch(self, X):
+        """(angles, velocities) for an (N, 3) array of decoder inputs"""
+        u = (np.asarray(X, dtype=float) - self.lows) / self.steps
+        cell = np.clip(np.floor(u).astype(int), 0, np.array(self._last))
+        f = np.clip(u - cell, 0.0, 1.0)
+        result = []
+        for grid in (self.angle, self.velocity):
+            value = 0.0
+            for corner in np.ndindex(2, 2, 2):
+                weight = np.prod(np.where(corner, f, 1.0 - f), axis=1)
+                value = value + weight * grid[tuple((cell + corner).T)]
+            result.append(value)
+        return tuple(result)
+
+    def max_error(self, FSAngle, FSVelocity, samples=ERROR_SAMPLES, seed=0):
+        """Max and mean absolute (angle, velocity) error against the fuzzy systems on random inputs"""
+        rng = np.random.default_rng(seed)
+        X = rng.uniform(self.lows, self.highs, size=(samples, self.lows.size))
+        angle, velocity = self.predict_batch(X)
+        angle_error = np.abs(angle - FSAngle.fit_batch(X))
+        velocity_error = np.abs(velocity - FSVelocity.fit_batch(X))
+        return {
+            'max_angle': float(angle_error.max()),
+            'mean_angle': float(angle_error.mean()),
+            'max_velocity': float(velocity_error.max()),
+            'mean_velocity': float(velocity_error.mean()),
+        }
+
+
+def make_decoder(FSAngle, FSVelocity, car, resolution=None):
+    """Decoder for a controller, LUT-backed when a grid resolution is given"""
+    if resolution:
+        return decoder.LUTDecoder(ControlSurfaceLUT.build(FSAngle, FSVelocity, resolution), car)
+    return decoder.Decoder(FSAngle, FSVelocity, car)
+
+def error_report(FSAngle, FSVelocity, resolutions, samples=ERROR_SAMPLES):
+    """Print build time, size and interpolation error for every grid resolution"""
+    print(f"\n{'Resolution':>10}{'Build [s]':>11}{'Size [KB]':>11}{'Max angle err':>15}{'Mean angle err':>16}"
+          f"{'Max vel err':>13}{'Mean vel err':>14}")
+    print("-" * 90)
+    for resolution in resolutions:
+        start = time.time()
+        lut = ControlSurfaceLUT.build(FSAngle, FSVelocity, resolution)
+        build_time = time.time() - start
+        error = lut.max_error(FSAngle, FSVelocity, samples)
+        size = (lut.angle.nbytes + lut.velocity.nbytes) / 1024
+        print(f"{resolution:>10}{build_time:>11.2f}{size:>11.0f}{error['max_angle']:>15.4f}{error['mean_angle']:>16.4f}"
+              f"{error['max_velocity']:>13.4f}{error['mean_velocity']:>14.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polygon', choices=['convex', 'sin'], help='Uses the trained controller of a polygon', required=True)
+    parser.add_argument('--model', help='Controller pickle (default: results/<polygon>/best_<polygon>.pickle)')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[16, 32, 64, 128], help='Grid points per input')
+    parser.add_argument('--samples', type=int, default=ERROR_SAMPLES, help='Random inputs for the error estimate')
+    parser.add_argument('--save', type=int, metavar='RESOLUTION', help='Saves a LUT of this resolution next to the model')
+
+    args = parser.parse_args()
+    model = args.model or model_path(args.polygon)
+    with open(model, 'rb') as f:
+        FSAngle, FSVelocity = pickle.load(f)
+
+    print(f"Controller: {model}")
+    error_report(FSAngle, FSVelocity, args.resolutions, args.samples)
+
+    if args.save:
+        lut = ControlSurfaceLUT.build(FSAngle, FSVelocity, args.save)
+        lut.save(lut_path(model))
+        print(f"\n[OK] LUT saved: {lut_path(model)}")
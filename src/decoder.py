@@ -22,6 +22,10 @@ class Decoder:
     def __init__(self, FSAngle, FSVelocity, car, debug = False):
         self.FSAngle = FSAngle
         self.FSVelocity = FSVelocity
+        if FSAngle is not None:
+            # Steps run on the compiled systems, the mi values of the text on the object graph
+            self.FS = fuzzy.CompiledMultiOutputFuzzySystem([FSAngle, FSVelocity])
+        self.text_FS = None
         self.car = car
         self.debug = debug
 
@@ -29,34 +33,55 @@ class Decoder:
         self.right_sensor_input = None
         self.front_sensor_input = None
         self.FSInput = None
-        self.fuzzy_text = None
 
-    def get_info(self):
+    @property
+    def evaluation(self):
+        # (solutions, input_mis, output_mis) of the last step, computed for the text only. Kept on the
+        # decoder, not on the shared fuzzy systems, so one trained controller can drive many cars at once
+        if self.text_FS is None:
+            self.text_FS = fuzzy.MultiOutputFuzzySystem([self.FSAngle, self.FSVelocity])
+        return self.text_FS.evaluate(self.FSInput)
+
+    @property
+    def fuzzy_text(self):
+        # Introspection text of the last step, built only when someone reads it
+        # (simulation screen). Training never does, so it costs nothing there
+        if self.FSInput is None:
+            return None
+        return self.get_info()
+
+    def sensor_info(self):
         out = ' SENSOR INPUTS:\n'
         out += ' left sensor input: ' + ("%1.2f" % self.left_sensor_input) + "\n"
         out += ' right sensor input: ' + ("%1.2f" % self.right_sensor_input) + '\n'
         out += ' front sensor input: ' + ("%1.2f" % self.front_sensor_input) + '\n'
         out += '\n'
+        return out
+
+    def get_info(self):
+        out = self.sensor_info()
+
+        (angle_solution, velocity_solution), (input_mi, _), (angle_mi, velocity_mi) = self.evaluation
 
         out += ' FUZZY INPUTS:\n'
-        for x in self.FSAngle.inputs:
+        for x, x_mi in zip(self.FSAngle.inputs, input_mi):
             out += ' ' + x.name + ':\n'
-            for y in x.inputs:
-                out += constants.TAB + ("%1.2f" % y.mi) + ' | ' + y.name + ' | ' + str(y) + '\n'
+            for y, mi in zip(x.inputs, x_mi):
+                out += constants.TAB + ("%1.2f" % mi) + ' | ' + y.name + ' | ' + str(y) + '\n'
         out += '\n'
 
         out += ' FUZZY OUTPUTS:\n'
         out += ' ' + self.FSAngle.output.name + ':\n'
-        for y in self.FSAngle.output:
-            out += constants.TAB + ("%1.2f" % y.mi) + ' | ' + y.name + ' | ' + str(y) + '\n'
+        for y, mi in zip(self.FSAngle.output, angle_mi):
+            out += constants.TAB + ("%1.2f" % mi) + ' | ' + y.name + ' | ' + str(y) + '\n'
 
         out += ' ' + self.FSVelocity.output.name + ':\n'
-        for y in self.FSVelocity.output:
-            out += constants.TAB + ("%1.2f" % y.mi) + ' | ' + y.name + ' | ' + str(y) + '\n'
+        for y, mi in zip(self.FSVelocity.output, velocity_mi):
+            out += constants.TAB + ("%1.2f" % mi) + ' | ' + y.name + ' | ' + str(y) + '\n'
 
         out += '\n'
-        out += ' angle solution: ' + ("%1.2f" % self.FSAngle.solution) +'\n'
-        out += ' velocity solution: ' + ("%1.2f" % self.FSVelocity.solution) +'\n\n'
+        out += ' angle solution: ' + ("%1.2f" % angle_solution) +'\n'
+        out += ' velocity solution: ' + ("%1.2f" % velocity_solution) +'\n\n'
         return out
         
         
@@ -65,20 +90,49 @@ class Decoder:
         clear()
         print(self.get_info())
 
-    def get_movement_params(self):
+    def read_sensors(self):
         self.left_sensor_input = float(self.car.left_sensor_input)*ALPHA
         self.front_sensor_input = float(self.car.front_sensor_input)*ALPHA
         self.right_sensor_input = float(self.car.right_sensor_input)*ALPHA
 
         self.FSInput = np.array([self.left_sensor_input, self.right_sensor_input, self.front_sensor_input])
-        self.FSAngle.fit(self.FSInput)
-        self.FSVelocity.fit(self.FSInput)
 
-        ds = (self.FSVelocity.solution*BETA)
-        drot = degree_to_radian(self.FSAngle.solution) + EPS
+    def get_movement_params(self):
+        self.read_sensors()
+        angle_solution, velocity_solution = self.FS.evaluate(self.FSInput)
+
+        ds = (velocity_solution*BETA)
+        drot = degree_to_radian(angle_solution) + EPS
+
+        if self.debug:
+            self.show_info()
+
+        return (ds, drot)
+
+class LUTDecoder(Decoder):
+    # Decoder driven by a precomputed control surface (control_lut.ControlSurfaceLUT)
+    # instead of the two fuzzy systems. Same scaling and movement params as Decoder
+    def __init__(self, lut, car, debug = False):
+        super().__init__(None, None, car, debug)
+        self.lut = lut
+        self.angle_solution = None
+        self.velocity_solution = None
+
+    def get_info(self):
+        out = self.sensor_info()
+        out += ' CONTROL SURFACE LUT: ' + 'x'.join(str(n) for n in self.lut.shape) + '\n\n'
+        out += ' angle solution: ' + ("%1.2f" % self.angle_solution) +'\n'
+        out += ' velocity solution: ' + ("%1.2f" % self.velocity_solution) +'\n\n'
+        return out
+
+    def get_movement_params(self):
+        self.read_sensors()
+        self.angle_solution, self.velocity_solution = self.lut.predict(self.FSInput)
+
+        ds = (self.velocity_solution*BETA)
+        drot = degree_to_radian(self.angle_solution) + EPS
 
         if self.debug:
             self.show_info()
-        self.fuzzy_text = self.get_info()
 
-        return (ds, drot)
\ No newline at end of file
+        return (ds, drot)
@@ -7,6 +7,8 @@
 #
 # Rule: Represents one rule for fuzzy system.
 #
+# MFInput, MFOutput and Rule use __slots__ (class Compact), rule antecedents are tuples.
+#
 # FuzzyInput: Represents set of input variables (MFInput). 
 #
 # FuzzyOutput: Represents set of output variables (MFOutput).
@@ -18,8 +20,37 @@
 # 1. For every F(i) in FuzzyInput: Calculate membership of element X(i) for every M(j) (MFInput) in F(i);
 # 2. Apply rules. This calculates membership value for every MFOutput in FuzzyOutput;
 # 3. Calculate final output value as centroid of all MFOutput values.
+#
+# MultiOutputFuzzySystem: Several FuzzySystems over the same inputs (FSAngle and FSVelocity).
+#                         Shared inputs are fuzzified once, then every system applies its own
+#                         rules and defuzzifies its own output. MF breakpoints, rule antecedents
+#                         and output centers are read into plain lists once, at construction.
+#
+# FuzzySystem.evaluate / MultiOutputFuzzySystem.evaluate: Reentrant counterparts of fit. They return
+#                         memberships and solutions as values and store nothing on the systems,
+#                         MFs or rules, so one controller can be shared by concurrent callers.
+#
+# CompiledFuzzySystem: Array snapshot of a FuzzySystem (FuzzySystem.compile()). MF breakpoints,
+#                      rule antecedent indices and output centers are stored as NumPy arrays, so
+#                      the same three steps run as a handful of array operations, for one input
+#                      vector (evaluate) or N of them (evaluate_batch, FuzzySystem.fit_batch).
+#                      One vector runs on Python lists (ScalarInputs, ScalarRules) instead: bisect
+#                      finds the interval of every input, and only the MFs and rules that can be
+#                      non-zero in those intervals are evaluated. Results are bit-identical to
+#                      FuzzySystem.fit. The snapshot does not follow later changes of the MF points
+#                      (e.g. GA mutation) - compile again after them.
+#
+# CompiledMultiOutputFuzzySystem: Compiled form of systems sharing their FuzzyInputs (FSAngle and
+#                      FSVelocity). The input vector is fuzzified once, then every compiled rule base
+#                      and output runs on it. Decoder uses it for every simulation step.
+#
+# PopulationFuzzySystem: Compiled form of P chromosomes that share the rule topology of
+#                        fuzzy_generator.set_rules and differ only in MF breakpoints. Breakpoints are
+#                        stacked into a (P, inputs, MFs, points) tensor, one call evaluates P input
+#                        vectors (one per chromosome) for the angle and the velocity system.
 
 
+import bisect
 import numpy as np
 import matplotlib.pyplot as plt
 from utils import constants
@@ -31,10 +62,36 @@ class Logic(Enum):
     OR = 0
     AND = 1
 
-class MFInput:
+def segment_y(x0, x1, y1, x2, y2):
+    # Calculates y value using triangle similarity theorem
+    if y1 == y2:
+        return y1
+    if y1 < y2:
+        return (x0 - x1) / (x2 -x1)
+    return (x2 - x0) / (x2 - x1)
+
+class Compact:
+    # Base of the per-MF and per-rule classes. They use __slots__ instead of a __dict__,
+    # since a GA population holds tens of thousands of them. __setstate__ also loads the
+    # __dict__ state of pickles saved before (results/*.pickle)
+    __slots__ = ()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            dict_state, slots_state = state
+            state = dict(dict_state or {}, **(slots_state or {}))
+        for name, value in state.items():
+            setattr(self, name, value)
+
+class MFInput(Compact):
+    __slots__ = ('name', 'points', 'size', 'x0', 'mi')
+
     def __init__(self, name, xs, ys):
         self.name = name
-        self.points = np.array(list(zip(xs, ys)))
+        self.points = np.column_stack((xs, ys))
         self.size = xs.size
         self.x0 = None
         self.mi = None
@@ -45,25 +102,24 @@ class MFInput:
         self.mi = self.getMi()
         
     def getY(self, x1, y1, x2, y2):
-        # Calculates y value using triangle similarity theorem
-        if y1 == y2:
-            return y1
-        if y1 < y2:
-            return (self.x0 - x1) / (x2 -x1)
-        return (x2 - self.x0) / (x2 - x1)
+        return segment_y(self.x0, x1, y1, x2, y2)
         
     def getMi(self):
-        if self.x0 <= self.points[0][0]: 
+        return self.membership(self.x0)
+
+    def membership(self, x0):
+        # Membership of x0 as a value, nothing is stored on the MF
+        if x0 <= self.points[0][0]: 
             return self.points[0][1]
-        if self.x0 >= self.points[-1][0]:
+        if x0 >= self.points[-1][0]:
             return self.points[-1][1]
         for i in range(1, self.size):
             x1 = self.points[i - 1][0]
             x2 = self.points[i][0]
-            if self.x0 >= x1 and self.x0 < x2:
+            if x0 >= x1 and x0 < x2:
                 y1 = self.points[i - 1][1]
                 y2 = self.points[i][1]
-                return self.getY(x1, y1, x2, y2)
+                return segment_y(x0, x1, y1, x2, y2)
         return None
         
     def __str__(self):
@@ -88,10 +144,12 @@ class MFInput:
         
         plt.plot([self.x0, self.x0], [0, self.mi], 'ro--')
 
-class MFOutput:
+class MFOutput(Compact):
+    __slots__ = ('name', 'points', 'size', 'center', 'mi')
+
     def __init__(self, name, xs, ys):
         self.name = name
-        self.points = np.array(list(zip(xs, ys)))
+        self.points = np.column_stack((xs, ys))
         self.size = xs.size
         
         # Calculates center position (used for centroid method)
@@ -124,15 +182,22 @@ class MFOutput:
         
         plt.plot([solution, solution], [0, 1], 'ro--')
 
-class Rule:
+class Rule(Compact):
+    __slots__ = ('inputs', 'output', 'operator')
+
     def __init__(self, inputs, output, operator = Logic.AND):
-        self.inputs = inputs
+        # inputs: MFInputs of the antecedent, kept as a tuple (no object ndarray per rule)
+        self.inputs = tuple(inputs)
         self.output = output
         self.operator = operator
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.inputs = tuple(self.inputs)
     
     def apply_rule(self):
         # Updates output variable based on given operator
-        n = self.inputs.size
+        n = len(self.inputs)
         if self.operator == Logic.OR:
             mi = 0
             for i in range(0, n):
@@ -144,9 +209,23 @@ class Rule:
 
         # Union of all rules    
         self.output.mi = max(self.output.mi, mi)
+
+    def strength(self, mis):
+        # Same as apply_rule, but reads input memberships from mis ({id(MFInput): mi})
+        # and returns the rule strength instead of updating the output
+        n = len(self.inputs)
+        if self.operator == Logic.OR:
+            mi = 0
+            for i in range(0, n):
+                mi = max(mi, mis[id(self.inputs[i])])
+        else:
+            mi = 1
+            for i in range(0, n):
+                mi = min(mi, mis[id(self.inputs[i])])
+        return mi
         
     def __str__(self):
-        n = self.inputs.size
+        n = len(self.inputs)
         out = ''
         for i in range(0, n-1):
             out = out + self.inputs[i].name + ' ' + str(self.operator) + ' '
@@ -213,17 +292,22 @@ class FuzzySystem:
         self.solution = None
         
     def fit(self, x0s):
-        # Restarting output mis
-        for mfo in self.output:
-            mfo.mi = 0
+        self.fuzzify(x0s)
+        self.infer()
 
-        # Fazzification
+    def fuzzify(self, x0s):
         # Calculate input membership values
         for i in range(0, self.inputs.size):
             x0 = x0s[i]
             for j in range(0, self.inputs[i].size):
                 self.inputs[i][j].setMi(x0)
-            
+
+    def infer(self):
+        # Rules and defuzzification on the current input mis (set by fuzzify)
+        # Restarting output mis
+        for mfo in self.output:
+            mfo.mi = 0
+
         # Apply rules
         for i in range(0, self.rules.size):
             self.rules[i].apply_rule()
@@ -240,6 +324,34 @@ class FuzzySystem:
         else:
             self.solution = numerator/denominator
         
+    def evaluate(self, x0s):
+        # Reentrant fit: returns (solution, input_mi, output_mi) with input_mi[i][j] the
+        # membership of self.inputs[i][j] and output_mi[k] of self.output[k]. No state is
+        # kept on the system or its MFs, so one system can serve concurrent callers
+        mis = input_memberships(enumerate(self.inputs), x0s)
+        output_mi, solution = self.infer_values(mis)
+        return solution, membership_values(self.inputs, mis), output_mi
+
+    def infer_values(self, mis):
+        # Stateless infer: (output_mi, solution) for input memberships mis ({id(MFInput): mi})
+        rule_mi = {id(mfo): 0 for mfo in self.output}
+        for i in range(0, self.rules.size):
+            rule = self.rules[i]
+            key = id(rule.output)
+            rule_mi[key] = max(rule_mi[key], rule.strength(mis))
+
+        output_mi = []
+        numerator = 0
+        denominator = 0
+        for mfo in self.output:
+            mi = rule_mi[id(mfo)]
+            output_mi.append(mi)
+            numerator += mi * mfo.center
+            denominator += mi
+        if denominator == 0:
+            return output_mi, 0
+        return output_mi, numerator/denominator
+
     def inputs_info(self):
         if self.solution == None:
             return
@@ -255,6 +367,14 @@ class FuzzySystem:
         self.inputs_info()
         self.output_info()
 
+    def compile(self):
+        return CompiledFuzzySystem(self)
+
+    def fit_batch(self, X):
+        # X: (N, inputs) array of input vectors. Returns (N,) solutions, same values as
+        # calling fit on every row. self.solution and the MF mi values are not touched
+        return self.compile().evaluate_batch(X)
+
     def __str__(self):
         out = ''
         for member in self.inputs:
@@ -268,6 +388,461 @@ class FuzzySystem:
             out = out + '\t' + str(m) + '\n'
         return out
 
+class MultiOutputFuzzySystem:
+    # Several FuzzySystems evaluated on the same input vector. Systems built by
+    # fuzzy_generator.build_random_fuzzy_system share their MFInputs, so every shared MF is
+    # fuzzified once per evaluate and then each rule base and output runs on it.
+    # Solutions and mi values are the same as calling fit on every system.
+    # The plan is a snapshot like CompiledFuzzySystem - build a new one after changing the MF points
+    def __init__(self, systems):
+        self.systems = systems
+        # Distinct MFInputs as (input index, xs, ys), every MF of the systems refers to its slot
+        self.mfs = []
+        slots = {}
+        for system in systems:
+            for i in range(0, system.inputs.size):
+                for mf in system.inputs[i]:
+                    if id(mf) not in slots:
+                        slots[id(mf)] = len(self.mfs)
+                        self.mfs.append((i, mf.points[:, 0].tolist(), mf.points[:, 1].tolist()))
+
+        # Per system: slots in the layout of its inputs, rules as (output position, is OR, slots)
+        # and output centers
+        self.plans = []
+        for system in systems:
+            outputs = {id(mfo): o for o, mfo in enumerate(system.output)}
+            layout = [[slots[id(mf)] for mf in fuzzy_input] for fuzzy_input in system.inputs]
+            rules = [(outputs[id(rule.output)], rule.operator == Logic.OR, tuple(slots[id(mf)] for mf in rule.inputs))
+                     for rule in system.rules]
+            self.plans.append((layout, rules, [mfo.center for mfo in system.output]))
+
+    def evaluate(self, x0s):
+        # Reentrant fit: returns (solutions, input_mis, output_mis), one entry per system in
+        # the layout of FuzzySystem.evaluate. Nothing is stored on the systems or their MFs
+        if isinstance(x0s, np.ndarray):
+            x0s = x0s.tolist()
+        mis = [breakpoint_membership(x0s[i], xs, ys) for i, xs, ys in self.mfs]
+        solutions = []
+        input_mis = []
+        output_mis = []
+        for layout, rules, centers in self.plans:
+            # Same order of min / max and of the centroid sums as FuzzySystem.infer
+            output_mi = [0]*len(centers)
+            for o, is_or, antecedents in rules:
+                if is_or:
+                    mi = 0
+                    for slot in antecedents:
+                        mi = max(mi, mis[slot])
+                else:
+                    mi = 1
+                    for slot in antecedents:
+                        mi = min(mi, mis[slot])
+                output_mi[o] = max(output_mi[o], mi)
+
+            numerator = 0
+            denominator = 0
+            for mi, center in zip(output_mi, centers):
+                numerator += mi * center
+                denominator += mi
+            solutions.append(0 if denominator == 0 else numerator/denominator)
+            input_mis.append([[mis[slot] for slot in row] for row in layout])
+            output_mis.append(output_mi)
+        return solutions, input_mis, output_mis
+
+def breakpoint_membership(x0, xs, ys):
+    # MFInput.membership on breakpoint lists xs, ys
+    if x0 <= xs[0]:
+        return ys[0]
+    if x0 >= xs[-1]:
+        return ys[-1]
+    for i in range(1, len(xs)):
+        x1 = xs[i - 1]
+        x2 = xs[i]
+        if x0 >= x1 and x0 < x2:
+            return segment_y(x0, x1, ys[i - 1], x2, ys[i])
+    return None
+
+def input_memberships(inputs, x0s):
+    # {id(MFInput): mi} for (i, FuzzyInput) pairs, input i is fuzzified with x0s[i]
+    mis = {}
+    for i, fuzzy_input in inputs:
+        x0 = x0s[i]
+        for j in range(0, fuzzy_input.size):
+            mis[id(fuzzy_input[j])] = fuzzy_input[j].membership(x0)
+    return mis
+
+def membership_values(inputs, mis):
+    # mis in the layout of inputs: values[i][j] is the membership of inputs[i][j]
+    return [[mis[id(mf)] for mf in fuzzy_input] for fuzzy_input in inputs]
+
+
+def padded_points(mf, size):
+    # Breakpoints of mf padded to size points by repeating the last point.
+    # Repeated points only add empty segments, so the membership is unchanged.
+    xs = np.full(size, mf.points[-1][0], dtype=float)
+    ys = np.full(size, mf.points[-1][1], dtype=float)
+    xs[:mf.size] = mf.points[:, 0]
+    ys[:mf.size] = mf.points[:, 1]
+    return xs, ys
+
+def segment_table(xs, ys):
+    # xs, ys: (..., points) padded breakpoints of MFInputs.
+    #
+    # Every MF is turned into an ordered list of segments [lo, hi) with value
+    # (x0 - pivot) / span + const, in the same order MFInput.getMi checks them:
+    # left edge, right edge, middle segments and a NaN catch-all (getMi returns None).
+    # The first segment that contains x0 gives the membership value.
+    # Falling segments use a negative span, constant ones an infinite span,
+    # which reproduces getY without changing a single bit.
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+    edge = xs[..., :1].shape
+    zeros = np.zeros(edge)
+    inf = np.full(edge, np.inf)
+
+    x1, x2 = xs[..., :-1], xs[..., 1:]
+    y1, y2 = ys[..., :-1], ys[..., 1:]
+    flat = y1 == y2
+    rising = y1 < y2
+    # Empty segments are never selected, span 1 only keeps them finite
+    span = np.where(x2 > x1, x2 - x1, 1.0)
+
+    lo = np.concatenate((-inf, xs[..., -1:], x1, -inf), axis=-1)
+    hi = np.concatenate((np.nextafter(xs[..., :1], np.inf), inf, x2, inf), axis=-1)
+    pivot = np.concatenate((zeros, zeros, np.where(rising, x1, x2), zeros), axis=-1)
+    span = np.concatenate((inf, inf, np.where(flat, np.inf, np.where(rising, span, -span)), inf), axis=-1)
+    const = np.concatenate((ys[..., :1], ys[..., -1:], np.where(flat, y1, 0.0), np.full(edge, np.nan)), axis=-1)
+    return lo, hi, pivot, span, const
+
+def interval_table(xs, ys):
+    # xs, ys: (..., MFs, points) padded breakpoints of all MFs of one input.
+    #
+    # The segment edges of all MFs split the input axis into intervals. Inside one interval
+    # every MF uses the same segment, so the interval index (number of edges <= x0) selects
+    # (pivot, span, const) of all MFs with a single lookup.
+    # Returns edges (..., E) padded with at least one NaN and table (3, ..., E + 1, MFs)
+    # of (pivot, span, const). With the NaN padding (edges <= x0).argmin() is the interval index.
+    lo, hi, pivot, span, const = segment_table(xs, ys)
+    edges = np.concatenate((lo, hi), axis=-1).reshape(lo.shape[:-2] + (-1,))
+    edges = np.sort(np.where(np.isfinite(edges), edges, np.nan), axis=-1)
+    edges = edges[..., :int(np.isfinite(edges).sum(axis=-1).max()) + 1]
+
+    # Left end of every interval, shape (..., intervals, 1, 1)
+    left = np.concatenate((np.full(edges[..., :1].shape, -np.inf), edges), axis=-1)[..., None, None]
+    lo, hi = lo[..., None, :, :], hi[..., None, :, :]
+    segment = ((lo <= left) & (left < hi)).argmax(axis=-1)[..., None]
+    table = np.stack([
+        np.take_along_axis(np.broadcast_to(values[..., None, :, :], segment.shape[:-1] + values.shape[-1:]), segment, axis=-1)[..., 0]
+        for values in (pivot, span, const)
+    ])
+    return edges, table
+
+def input_breakpoints(inputs, n_mfs, n_points):
+    # MF breakpoints of a FuzzyInput array, shape (inputs, MFs + 2, points), and the flat
+    # position of every MFInput. Two extra constant MFs per input hold 1 (AND neutral)
+    # and 0 (OR neutral), missing MFs are 0
+    xs = np.zeros((inputs.size, n_mfs + 2, n_points))
+    ys = np.zeros((inputs.size, n_mfs + 2, n_points))
+    ys[:, n_mfs] = 1
+    index = {}
+    for i in range(inputs.size):
+        for j in range(inputs[i].size):
+            mf = inputs[i][j]
+            xs[i, j], ys[i, j] = padded_points(mf, n_points)
+            index[id(mf)] = i*(n_mfs + 2) + j
+    return xs, ys, index
+
+class CompiledInputs:
+    # Fuzzification of MF breakpoints xs, ys: (..., inputs, MFs + 2, points).
+    # Leading dimensions stack independent systems (e.g. a population)
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        self.and_index = xs.shape[-2] - 2
+        self.or_index = xs.shape[-2] - 1
+
+        # Interval lookup, table rows of every input start at a fixed offset
+        self.edges, table = interval_table(xs, ys)
+        intervals = table.shape[-2]
+        self.table = np.ascontiguousarray(table.reshape(3, -1, table.shape[-1]))
+        self.interval_offset = np.arange(self.table.shape[1] // intervals).reshape(xs.shape[:-2]) * intervals
+
+    def memberships(self, x0s):
+        # x0s: (..., inputs), result: (..., inputs, MFs + 2)
+        x0 = np.asarray(x0s, dtype=float)[..., None]
+        interval = (self.edges <= x0).argmin(axis=-1) + self.interval_offset
+        pivot, span, const = self.table.take(interval, axis=1)
+        return (x0 - pivot) / span + const
+
+class CompiledRules:
+    # Rule base of one output. Antecedents are flat MF positions (input_breakpoints),
+    # shape (antecedents, rules), padded with the neutral MF of the rule operator. Rules are
+    # grouped by output MF and every group starts with an always-zero rule, the initial
+    # value of MFOutput.mi
+    def __init__(self, rules, output, index, and_index, or_index):
+        outputs = list(output)
+        width = max(len(rule.inputs) for rule in rules)
+        antecedents = []
+        is_or = []
+        self.output_start = np.zeros(len(outputs), dtype=int)
+        for o in range(len(outputs)):
+            self.output_start[o] = len(antecedents)
+            antecedents.append([or_index]*width)
+            is_or.append(False)
+            for rule in rules:
+                if rule.output is not outputs[o]:
+                    continue
+                pad = or_index if rule.operator == Logic.OR else and_index
+                antecedents.append([index[id(mf)] for mf in rule.inputs] + [pad]*(width - len(rule.inputs)))
+                is_or.append(rule.operator == Logic.OR)
+        self.antecedents = np.array(antecedents).T.copy()
+        self.is_or = np.array(is_or)
+        self.any_or = bool(self.is_or.any())
+
+    def same_topology(self, other):
+        return (np.array_equal(self.antecedents, other.antecedents) and np.array_equal(self.is_or, other.is_or)
+                and np.array_equal(self.output_start, other.output_start))
+
+    def apply(self, mi):
+        # Rule strength (min for AND, max for OR), then union of all rules per output MF.
+        # mi: (..., inputs, MFs + 2), result: (..., outputs)
+        rule_mi = mi.reshape(mi.shape[:-2] + (-1,)).take(self.antecedents, axis=-1)
+        firing = np.minimum.reduce(rule_mi, axis=-2)
+        if self.any_or:
+            firing = np.where(self.is_or, np.maximum.reduce(rule_mi, axis=-2), firing)
+        return np.maximum.reduceat(firing, self.output_start, axis=-1)
+
+class ScalarInputs:
+    # CompiledInputs of one system as Python lists, for one input vector at a time. Per input the
+    # finite interval edges, bisect gives the interval index of CompiledInputs.memberships.
+    # segments(i, k) holds per MF of input i its membership in interval k, an exact constant on a
+    # flat segment since (x0 - pivot) / inf is a signed zero, or the (i, pivot, span, const) of its
+    # sloped segment. Rows are built on their first use
+    def __init__(self, inputs):
+        self.width = inputs.xs.shape[-2]
+        self.edges = [row[np.isfinite(row)].tolist() for row in inputs.edges]
+        self.offsets = inputs.interval_offset.tolist()
+        self.table = inputs.table.tolist()
+        self.rows = {}
+
+    def intervals(self, x0s):
+        # Interval of every input of one input vector
+        return tuple(map(bisect.bisect_right, self.edges, x0s))
+
+    def segments(self, i, k):
+        row = self.rows.get((i, k))
+        if row is None:
+            pivot, span, const = (values[self.offsets[i] + k] for values in self.table)
+            row = self.rows[i, k] = [c if s == float('inf') or s == -float('inf') else (i, p, s, c)
+                                     for p, s, c in zip(pivot, span, const)]
+        return row
+
+class ScalarRules:
+    # CompiledRules of one system on ScalarInputs. Every combination of input intervals gets a plan,
+    # built on its first use: per output MF the rules that can fire, with their constant antecedents
+    # folded into one bound and the sloped ones as segments. Rules that fire 0 in those intervals are
+    # dropped, and so are output MFs that stay at 0 - they only add zeros to the centroid sums.
+    # A step evaluates a few segments and rules instead of all of them
+    def __init__(self, rules, inputs, centers):
+        self.inputs = inputs
+        self.centers = centers
+        self.outputs = np.searchsorted(rules.output_start, np.arange(rules.is_or.size), side='right') - 1
+        self.outputs = self.outputs.tolist()
+        self.is_or = rules.is_or.tolist()
+        # Antecedent MFs of every rule per input, as positions in that input
+        self.antecedents = [[[] for _ in inputs.edges] for _ in self.is_or]
+        for r, antecedents in enumerate(rules.antecedents.T.tolist()):
+            for a in antecedents:
+                i, j = divmod(a, inputs.width)
+                self.antecedents[r][i].append(j)
+        self.partials = {}
+        self.plans = {}
+
+    def partial(self, i, k):
+        # {rule: (bound, sloped segments)} of the rules that can fire in interval k of input i, their
+        # antecedents of input i only
+        partial = self.partials.get((i, k))
+        if partial is None:
+            segments = self.inputs.segments(i, k)
+            partial = self.partials[i, k] = {}
+            for r, is_or in enumerate(self.is_or):
+                bound = 0.0 if is_or else 1.0
+                sloped = []
+                for j in self.antecedents[r][i]:
+                    segment = segments[j]
+                    if isinstance(segment, tuple):
+                        sloped.append(segment)
+                    elif is_or:
+                        bound = max(bound, segment)
+                    else:
+                        bound = min(bound, segment)
+                if is_or or bound > 0:
+                    partial[r] = (bound, sloped)
+        return partial
+
+    def plan(self, intervals):
+        # ((center, initial mi, rules), ...) of the output MFs that can be non-zero, in output order.
+        # A rule is (is OR, bound, input, pivot, span, const, other sloped segments)
+        partials = [self.partial(i, k) for i, k in enumerate(intervals)]
+        live = set(partials[0])
+        for partial in partials[1:]:
+            live.intersection_update(partial)
+        outputs = [[0.0, []] for _ in self.centers]
+        for r in sorted(live):
+            is_or = self.is_or[r]
+            bounds = [partial[r][0] for partial in partials]
+            bound = max(bounds) if is_or else min(bounds)
+            sloped = [segment for partial in partials for segment in partial[r][1]]
+            o = self.outputs[r]
+            if not sloped:
+                # Same value for every input vector of these intervals
+                outputs[o][0] = max(outputs[o][0], bound)
+            elif is_or or bound > 0:
+                outputs[o][1].append((is_or, bound) + sloped[0] + (tuple(sloped[1:]),))
+        return tuple((center, mi, tuple(rules)) for center, (mi, rules) in zip(self.centers, outputs) if mi or rules)
+
+    def solution(self, x0s, intervals):
+        # Rules and centroid, same value as defuzzify(CompiledRules.apply(mi)) on the memberships of x0s.
+        # min / max of a rule are taken in another order, which gives the same value
+        plan = self.plans.get(intervals)
+        if plan is None:
+            plan = self.plans[intervals] = self.plan(intervals)
+        numerator = 0
+        denominator = 0
+        for center, output_mi, rules in plan:
+            for is_or, bound, i, pivot, span, const, sloped in rules:
+                mi = (x0s[i] - pivot) / span + const
+                if is_or:
+                    mi = mi if mi > bound else bound
+                    for i, pivot, span, const in sloped:
+                        mi = max(mi, (x0s[i] - pivot) / span + const)
+                else:
+                    mi = mi if mi < bound else bound
+                    for i, pivot, span, const in sloped:
+                        mi = min(mi, (x0s[i] - pivot) / span + const)
+                if mi > output_mi:
+                    output_mi = mi
+            numerator += output_mi * center
+            denominator += output_mi
+        if denominator == 0:
+            return 0
+        return numerator/denominator
+
+def output_centers(output):
+    return np.array([mfo.center for mfo in output], dtype=float)
+
+def defuzzify(output_mi, centers):
+    # Centroid method. Summed in the same order as FuzzySystem.fit to keep the result bit-identical
+    numerator = 0
+    denominator = 0
+    for mi, center in zip(output_mi.tolist(), centers.tolist()):
+        numerator += mi * center
+        denominator += mi
+    if denominator == 0:
+        return 0
+    return numerator/denominator
+
+def defuzzify_batch(output_mi, centers):
+    # Centroid method for output_mi: (N, outputs), centers: (outputs,) or (N, outputs).
+    # Columns are accumulated one by one, which keeps the summation order of FuzzySystem.fit
+    numerator = np.zeros(output_mi.shape[0])
+    denominator = np.zeros(output_mi.shape[0])
+    for o in range(output_mi.shape[1]):
+        numerator = numerator + output_mi[:, o] * centers[..., o]
+        denominator = denominator + output_mi[:, o]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator == 0, 0.0, numerator / denominator)
+
+def mf_layout(inputs):
+    # Number of MFs and points of the widest input / MF
+    n_mfs = max(fuzzy_input.size for fuzzy_input in inputs)
+    n_points = max(mf.size for fuzzy_input in inputs for mf in fuzzy_input)
+    return n_mfs, n_points
+
+class CompiledFuzzySystem:
+    def __init__(self, system):
+        xs, ys, index = input_breakpoints(system.inputs, *mf_layout(system.inputs))
+        self.inputs = CompiledInputs(xs, ys)
+        self.rules = CompiledRules(system.rules, system.output, index, self.inputs.and_index, self.inputs.or_index)
+        self.centers = output_centers(system.output)
+        self.scalar_inputs = ScalarInputs(self.inputs)
+        self.scalar_rules = ScalarRules(self.rules, self.scalar_inputs, self.centers.tolist())
+        self.solution = None
+
+    def memberships(self, x0s):
+        # Fazzification, x0s: (..., inputs)
+        return self.inputs.memberships(x0s)
+
+    def apply_rules(self, mi):
+        return self.rules.apply(mi)
+
+    def defuzzify(self, output_mi):
+        return defuzzify(output_mi, self.centers)
+
+    def evaluate(self, x0s):
+        if isinstance(x0s, np.ndarray):
+            x0s = x0s.tolist()
+        return self.scalar_rules.solution(x0s, self.scalar_inputs.intervals(x0s))
+
+    def evaluate_batch(self, X):
+        # X: (N, inputs), one input vector per row. Returns (N,) solutions
+        X = np.asarray(X, dtype=float)
+        return defuzzify_batch(self.apply_rules(self.memberships(X)), self.centers)
+
+    def fit(self, x0s):
+        self.solution = self.evaluate(x0s)
+
+class CompiledMultiOutputFuzzySystem:
+    # CompiledFuzzySystem of several systems over the same FuzzyInputs, one fuzzification per evaluate.
+    # Solutions are bit-identical to calling fit on every system
+    def __init__(self, systems):
+        xs, ys, index = input_breakpoints(systems[0].inputs, *mf_layout(systems[0].inputs))
+        self.inputs = CompiledInputs(xs, ys)
+        self.rules = [CompiledRules(system.rules, system.output, index, self.inputs.and_index, self.inputs.or_index)
+                      for system in systems]
+        self.scalar_inputs = ScalarInputs(self.inputs)
+        self.scalar_rules = [ScalarRules(rules, self.scalar_inputs, output_centers(system.output).tolist())
+                             for rules, system in zip(self.rules, systems)]
+
+    def evaluate(self, x0s):
+        # One solution per system
+        if isinstance(x0s, np.ndarray):
+            x0s = x0s.tolist()
+        intervals = self.scalar_inputs.intervals(x0s)
+        return [rules.solution(x0s, intervals) for rules in self.scalar_rules]
+
+class PopulationFuzzySystem:
+    # Stacks P members - tuples of FuzzySystems sharing one FuzzyInput array, e.g. a
+    # chromosome's (FSAngle, FSVelocity) - that only differ in MF breakpoints.
+    # MF breakpoints form a (P, inputs, MFs, points) tensor and one evaluate call
+    # fuzzifies P input vectors (one per member) and runs every rule base on them.
+    def __init__(self, members):
+        members = [tuple(member) for member in members]
+        n_mfs, n_points = mf_layout(members[0][0].inputs)
+        xs = np.zeros((len(members), members[0][0].inputs.size, n_mfs + 2, n_points))
+        ys = np.zeros(xs.shape)
+        self.rules = None
+        self.centers = [np.zeros((len(members), system.output.size)) for system in members[0]]
+        for p, member in enumerate(members):
+            xs[p], ys[p], index = input_breakpoints(member[0].inputs, n_mfs, n_points)
+            rules = [CompiledRules(system.rules, system.output, index, n_mfs, n_mfs + 1) for system in member]
+            if self.rules is None:
+                self.rules = rules
+            elif not all(a.same_topology(b) for a, b in zip(self.rules, rules)):
+                raise ValueError('Population members must share the rule topology')
+            for s, system in enumerate(member):
+                self.centers[s][p] = output_centers(system.output)
+        self.inputs = CompiledInputs(xs, ys)
+
+    def __len__(self):
+        return self.inputs.xs.shape[0]
+
+    def evaluate(self, X):
+        # X: (P, inputs), row p is the input vector of member p.
+        # Returns one (P,) solution array per system of a member
+        mi = self.inputs.memberships(X)
+        return tuple(defuzzify_batch(rules.apply(mi), centers) for rules, centers in zip(self.rules, self.centers))
+
 if __name__ == '__main__':
     with open(constants.PRETRAINED_FUZZY_PATH, 'rb') as f:
         fz = pickle.load(f)
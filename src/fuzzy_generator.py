@@ -56,15 +56,15 @@ def get_ys(size):
             ys.append(1)
     return ys
 
-def get_xs(size, left, right):
+def get_xs(size, left, right, rand = random):
     """
-    Generates key points for trapezoidal functions.
+    Generates key points for trapezoidal functions, rand is the random source (random module or a random.Random).
 
     Guarantees that there are no uncovered areas of the x-axis
     """
     number_of_points = 4*(size-1)
     #? split interval to parts within key_points represented by the key_points array 
-    key_points = random.sample(range(left+1, right-1), size-1)
+    key_points = rand.sample(range(left+1, right-1), size-1)
     key_points.append(left)
     key_points.append(right)
     key_points.sort()
@@ -76,18 +76,18 @@ def get_xs(size, left, right):
 
     for i in range(1, size-1):
         #? choose middle points for the trapezoid
-        new_xs = random.sample(range(key_points[i]-1, key_points[i+1]+1), 2)
+        new_xs = rand.sample(range(key_points[i]-1, key_points[i+1]+1), 2)
         new_xs.sort()
 
         #? choose left-most edge so that is for sure 'leftest' point in the trapezoid 
-        xs.append(random.randint(key_points[i-1]+1, key_points[i]))
+        xs.append(rand.randint(key_points[i-1]+1, key_points[i]))
         
         #? append middle points
         xs.append(new_xs[0])
         xs.append(new_xs[1])
         
         #? choose right-most edge so that is for sure 'rightest' point in the trapezoid
-        xs.append(random.randint(key_points[i+1], key_points[i+2]-1))
+        xs.append(rand.randint(key_points[i+1], key_points[i+2]-1))
     
     #? right most figure (isn't a trapeziod)
     xs.append(key_points[-2])
@@ -116,12 +116,12 @@ def xy_split(xs, ys, size):
     
     return (xs_split, ys_split)
     
-def random_fuzzy(name, func_names, left, right, is_input = True):
+def random_fuzzy(name, func_names, left, right, is_input = True, rand = random):
     size = len(func_names)
     number_of_points = 4*(size-1)
     
     #? generate_functions
-    xs = get_xs(size, left, right)
+    xs = get_xs(size, left, right, rand)
     ys = get_ys(number_of_points)
     
     #? build_single_fuzzy_io
@@ -200,7 +200,7 @@ def set_rules(left_sensor, front_sensor, right_sensor, f_angle, f_velocity):
 
     return angle_rules, velocity_rules
 
-def build_random_fuzzy_system():
+def build_random_fuzzy_system(rand = random):
     fuzzy_inputs = {}
     fuzzy_outputs = {}
     
@@ -212,9 +212,9 @@ def build_random_fuzzy_system():
         names = ALL_FUZZY_FUNCS[fuzzy_key]["mf_names"]
         
         if is_input:
-            fuzzy_inputs[name] = random_fuzzy(name, names, left, right, is_input)
+            fuzzy_inputs[name] = random_fuzzy(name, names, left, right, is_input, rand)
         else:
-            fuzzy_outputs[name] = random_fuzzy(name, names, left, right, is_input)
+            fuzzy_outputs[name] = random_fuzzy(name, names, left, right, is_input, rand)
           
     left_sensor = fuzzy_inputs["left_sensor"]
     front_sensor = fuzzy_inputs["front_sensor"]
@@ -1,6 +1,13 @@
+import os
+import time
 import numpy as np
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, Future
 
 import vehicle
+import sensor_field
+import fuzzy
 from utils import constants
 from utils import load_path as lp
 import decoder
@@ -9,20 +16,318 @@ TIME_STEP = 0.1
 MAX_ITERATIONS = 500
 MIN_DISTANCE = 50
 
-def get_sensors(car, road_matrix, memory):
-    car_x = int(car.center_position().x)
-    car_y = int(car.center_position().y)
-    angle = int(car.angle)
-    if (car_x, car_y, angle) in memory:
-        return memory[(car_x, car_y, angle)]
-    left, front, right = car.get_sensors2(road_matrix)
-    memory[(car_x, car_y, angle)] = (left, front, right)
-    return left, front, right
+SENSOR_CACHE_SIZE = 500000
+SHARED_MEMORY_PATH = '/dev/shm'
+EVICTION_POLICIES = ('lru', 'fifo')
 
-def evaluate(FSAngle, FSVelocity, road_matrix, memory):
+class SensorCache:
     """
-    Runs a single simulation, movement params are calculated based on the fuzzy systems FSAngle and FSVelocity
+    Bounded (x, y, heading) -> (left, front, right) memo of the sensor readings.
+    Keys use the integer pixel of the car center and the integer heading wrapped to 0-359,
+    so equivalent headings share an entry. Once max_entries is reached the least recently
+    used ('lru') or the oldest ('fifo') entry is evicted.
     """
+    def __init__(self, max_entries = SENSOR_CACHE_SIZE, policy = 'lru'):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError('Unknown eviction policy: {}'.format(policy))
+        self.max_entries = max_entries
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.reset_stats()
+
+    # Checkpoint arrays of the keys and values (contents)
+    CONTENT_KEYS = ('sensor_keys', 'sensor_values')
+
+    @staticmethod
+    def key(car):
+        center = car.center_position()
+        return int(center.x), int(center.y), int(car.angle % 360) % 360
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.policy == 'lru':
+                self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def lookup(self, car, road_matrix):
+        key = self.key(car)
+        readings = self.get(key)
+        if readings is None:
+            readings = car.get_sensors3(road_matrix)
+            self.put(key, readings)
+        return readings
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def contents(self):
+        """Entries as arrays for a checkpoint, in eviction order"""
+        keys, values = self.CONTENT_KEYS
+        return {
+            keys: np.array(list(self.entries.keys()), dtype=np.int32).reshape(-1, 3),
+            values: np.array(list(self.entries.values()), dtype=float).reshape(-1, 3),
+        }
+
+    def restore(self, contents):
+        """Entries of contents, ignored when they come from another kind of cache"""
+        keys, values = self.CONTENT_KEYS
+        if keys not in contents:
+            return
+        for key, value in zip(contents[keys].tolist(), contents[values].tolist()):
+            self.put(tuple(key), tuple(value))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return 'entries: {entries} hits: {hits} misses: {misses} evictions: {evictions} hit rate: {hit_rate:.1%}'.format(**self.stats())
+
+class FitnessCache:
+    """
+    Fitness of the genomes already evaluated on one track, keyed by genome.genome_hash.
+    Pruned values depend on the bound of their run and are not stored
+    """
+    def __init__(self):
+        self.fitness = {}
+        self.reset_stats()
+
+    def get(self, key):
+        value = self.fitness.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not isinstance(value, Pruned):
+            self.fitness[key] = value
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.fitness),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def contents(self):
+        """Genome hashes and fitness values as arrays for a checkpoint"""
+        return {
+            'fitness_keys': np.array([list(key) for key in self.fitness], dtype=np.uint8),
+            'fitness_values': np.array(list(self.fitness.values()), dtype=float),
+        }
+
+    def restore(self, contents):
+        for key, value in zip(contents['fitness_keys'], contents['fitness_values'].tolist()):
+            self.fitness[key.tobytes()] = value
+
+    def __len__(self):
+        return len(self.fitness)
+
+    def __str__(self):
+        return 'genomes: {entries} skipped evaluations: {hits} evaluated: {misses} ({hit_rate:.1%} skipped)'.format(**self.stats())
+
+def canonical_car(x, y, heading):
+    """Car of the canonical pose of a cache key: centered on the pixel center, integer heading"""
+    return vehicle.Car(x + 0.5 - constants.CAR_WIDTH/2, y + 0.5 - constants.CAR_HEIGHT/2, heading)
+
+def canonical_readings(x, y, heading, road_matrix):
+    """(left, front, right) get_sensors3 readings of the canonical pose of a cache key"""
+    return canonical_car(x, y, heading).get_sensors3(road_matrix)
+
+class CanonicalSensorCache(SensorCache):
+    """
+    SensorCache of the readings of the canonical pose of every key (canonical_readings), the values
+    a SharedSensorCache slot gives. A reading does not depend on the pose that filled its entry, so
+    serial and pool runs give the same fitness. Off-road and off-screen keys read (0, 0, 0) and are not stored
+    """
+    CONTENT_KEYS = ('canonical_keys', 'canonical_values')
+
+    def __init__(self, road_matrix, max_entries = SENSOR_CACHE_SIZE, policy = 'lru'):
+        super().__init__(max_entries, policy)
+        self.index = sensor_field.row_index(sensor_field.road_mask(road_matrix))
+
+    def lookup(self, car, road_matrix):
+        return self.read(*self.key(car), road_matrix)
+
+    def read(self, x, y, heading, road_matrix):
+        # Readings of a key, see lookup
+        if not vehicle.valid_position(x, y) or self.index[x, y] == 0:
+            # Rays of an off-road or off-screen car stop at once
+            return 0.0, 0.0, 0.0
+        key = (x, y, heading)
+        readings = self.get(key)
+        if readings is None:
+            readings = canonical_readings(x, y, heading, road_matrix)
+            self.put(key, readings)
+        return readings
+
+class SharedSensorCache:
+    """
+    Sensor cache in a preallocated shared memory block, filled by every process that attaches it.
+    One uint16 slot of ray steps + 1 (0 = empty) per road pixel, heading degree and ray, rows
+    as in sensor_field. A slot is measured from its canonical pose (pixel center, integer
+    heading), so its value depends only on the key: concurrent writers store the same numbers and
+    reads need no lock, and results do not depend on which process filled a slot first.
+    Readings are the distances of the stored steps from the canonical pose, as in CanonicalSensorCache.
+    Pickles by name, so pool workers attach to the same block.
+    """
+    def __init__(self, road_matrix, name = None):
+        mask = sensor_field.road_mask(road_matrix)
+        self.road_matrix = road_matrix
+        self.index = sensor_field.row_index(mask)
+        shape = SharedSensorCache.shape(road_matrix)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=int(np.prod(shape))*2)
+        self.steps = np.ndarray(shape, dtype=np.uint16, buffer=self.shm.buf)
+        self.reset_stats()
+
+    @staticmethod
+    def shape(road_matrix):
+        return (np.count_nonzero(sensor_field.road_mask(road_matrix)) + 1, 360, 3)
+
+    @staticmethod
+    def fits(road_matrix):
+        """
+        True if SHARED_MEMORY_PATH has room for the whole block. The block is allocated lazily,
+        so a too small file system would only fail (SIGBUS) once the workers fill it
+        """
+        try:
+            stats = os.statvfs(SHARED_MEMORY_PATH)
+        except (OSError, AttributeError):
+            # No such file system to check (e.g. not Linux)
+            return True
+        return int(np.prod(SharedSensorCache.shape(road_matrix)))*2 <= stats.f_bavail*stats.f_frsize
+
+    def __reduce__(self):
+        return SharedSensorCache, (self.road_matrix, self.shm.name)
+
+    def lookup(self, car, road_matrix):
+        x, y, heading = SensorCache.key(car)
+        if not vehicle.valid_position(x, y) or self.index[x, y] == 0:
+            # Rays of an off-road or off-screen car stop at once
+            return 0.0, 0.0, 0.0
+        slot = self.steps[self.index[x, y], heading]
+        canonical = canonical_car(x, y, heading)
+        if slot.all():
+            self.hits += 1
+            return canonical.sensor_distances([z - 1 for z in slot.tolist()])
+        self.misses += 1
+
+        steps = canonical.sensor_steps(road_matrix)
+        slot[:] = [z + 1 for z in steps]
+        return canonical.sensor_distances(steps)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': int(np.count_nonzero(self.steps[..., 0])),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def contents(self):
+        """Filled slots (flat indices of steps[..., 0]) and their steps as arrays for a checkpoint"""
+        slots = np.flatnonzero(self.steps[..., 0])
+        return {
+            'shared_shape': np.array(self.steps.shape),
+            'shared_slots': slots,
+            'shared_steps': self.steps.reshape(-1, 3)[slots],
+        }
+
+    def restore(self, contents):
+        """Slots of contents, ignored when they come from another kind of cache or road"""
+        if 'shared_shape' not in contents or tuple(contents['shared_shape']) != self.steps.shape:
+            return
+        self.steps.reshape(-1, 3)[contents['shared_slots']] = contents['shared_steps']
+
+    def close(self):
+        self.steps = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __str__(self):
+        return 'entries: {entries} hits: {hits} misses: {misses} hit rate: {hit_rate:.1%}'.format(**self.stats())
+
+class Pruned(float):
+    """
+    Fitness of a run stopped early because it could no longer beat the bound given to evaluate.
+    The value is a lower bound of the exact fitness, skipped_steps the simulation steps the run
+    had left at most
+    """
+    def __new__(cls, value, skipped_steps = 0):
+        pruned = super().__new__(cls, value)
+        pruned.skipped_steps = skipped_steps
+        return pruned
+
+    def __reduce__(self):
+        return Pruned, (float(self), self.skipped_steps)
+
+    def __repr__(self):
+        return 'Pruned({})'.format(float(self))
+
+def fitness_lower_bound(left_right):
+    # left_right only grows and a run lasts at most MAX_ITERATIONS + 1 steps
+    return left_right/(MAX_ITERATIONS + 1)
+
+def pruning_stats(fitness_values):
+    pruned = [f for f in fitness_values if isinstance(f, Pruned)]
+    return {
+        'evaluations': len(fitness_values),
+        'pruned': len(pruned),
+        'skipped_steps': sum(f.skipped_steps for f in pruned),
+    }
+
+# Simulation steps run by evaluate and evaluate_batch in this process, evaluators count theirs from it
+simulated_steps = 0
+
+def get_sensors(car, road_matrix, cache, field = None):
+    # A precomputed sensor_field.SensorField of the road answers with a table lookup
+    if field is not None:
+        return field.read(car)
+    return cache.lookup(car, road_matrix)
+
+def evaluate(FSAngle, FSVelocity, road_matrix, cache, field = None, bound = None):
+    """
+    Runs a single simulation, movement params are calculated based on the fuzzy systems FSAngle and FSVelocity.
+    With a bound, a run whose fitness can no longer get below it stops and returns a Pruned lower bound
+    """
+    global simulated_steps
     car = vehicle.Car(constants.CAR_POS_X, constants.CAR_POS_Y, constants.CAR_ANGLE)
 
     iteration = 0
@@ -37,7 +342,7 @@ def evaluate(FSAngle, FSVelocity, road_matrix, memory):
 
     while iteration <= MAX_ITERATIONS:
         
-        car.left_sensor_input, car.front_sensor_input, car.right_sensor_input = get_sensors(car, road_matrix, memory)
+        car.left_sensor_input, car.front_sensor_input, car.right_sensor_input = get_sensors(car, road_matrix, cache, field)
         ds, drot = dec.get_movement_params()
         car.update(dt, ds, drot)
 
@@ -57,4 +362,222 @@ def evaluate(FSAngle, FSVelocity, road_matrix, memory):
             punishment = 150
             break
 
-    return left_right/iteration + punishment
\ No newline at end of file
+        if bound is not None and fitness_lower_bound(left_right) > bound:
+            simulated_steps += iteration
+            return Pruned(fitness_lower_bound(left_right), MAX_ITERATIONS + 1 - iteration)
+
+    simulated_steps += iteration
+    return left_right/iteration + punishment
+
+def evaluate_batch(systems, road_matrix, field = None, bound = None, cache = None):
+    """
+    Runs the simulations of many (FSAngle, FSVelocity) pairs in lockstep. Positions, headings and
+    accumulators of all cars are arrays, every step reads all sensors, runs all controllers
+    through one fuzzy.PopulationFuzzySystem and moves all cars still running. Sensors come from
+    the field or from a CanonicalSensorCache (a new one by default), so the fitness values,
+    Pruned values included, are those of evaluate with the same field or a SerialEvaluator
+    """
+    global simulated_steps
+    if field is None and cache is None:
+        cache = CanonicalSensorCache(road_matrix)
+    population = fuzzy.PopulationFuzzySystem(systems)
+    n = len(population)
+    x = np.full(n, float(constants.CAR_POS_X))
+    y = np.full(n, float(constants.CAR_POS_Y))
+    angle = np.full(n, float(constants.CAR_ANGLE))
+    dt = TIME_STEP
+
+    past_x = x + constants.CAR_WIDTH/2
+    past_y = y + constants.CAR_HEIGHT/2
+    last_x = np.full(n, np.nan)
+    last_y = np.full(n, np.nan)
+
+    running = np.ones(n, dtype=bool)
+    pruned = np.zeros(n, dtype=bool)
+    iterations = np.zeros(n, dtype=int)
+    punishment = np.zeros(n)
+    left_right = np.zeros(n)
+    X = np.zeros((n, 3))
+
+    iteration = 0
+    while iteration <= MAX_ITERATIONS and running.any():
+        cars = np.flatnonzero(running)
+        center_x = x[cars] + constants.CAR_WIDTH/2
+        center_y = y[cars] + constants.CAR_HEIGHT/2
+        if field is not None:
+            sensors = field.read_batch(center_x, center_y, angle[cars])
+        else:
+            # SensorCache.key of every car
+            keys = zip(center_x.astype(int).tolist(), center_y.astype(int).tolist(), (np.mod(angle[cars], 360).astype(int) % 360).tolist())
+            sensors = np.array([cache.read(*key, road_matrix) for key in keys])
+
+        # Decoder input order: left, right, front
+        X[cars] = sensors[:, [0, 2, 1]]*decoder.ALPHA
+        angle_solution, velocity_solution = population.evaluate(X)
+        ds = velocity_solution[cars]*decoder.BETA
+        drot = decoder.degree_to_radian(angle_solution[cars]) + decoder.EPS
+        x[cars], y[cars], angle[cars] = vehicle.update_batch(x[cars], y[cars], angle[cars], dt, ds, drot)
+
+        iteration += 1
+        iterations[cars] = iteration
+        left_right[cars] += np.abs(sensors[:, 0] - sensors[:, 2])
+
+        center_x = x[cars] + constants.CAR_WIDTH/2
+        center_y = y[cars] + constants.CAR_HEIGHT/2
+        stopped = np.zeros(cars.size, dtype=bool)
+        if iteration % 100 == 0:
+            stopped = np.sqrt((past_x[cars] - center_x)**2 + (past_y[cars] - center_y)**2) < MIN_DISTANCE
+            past_x[cars] = center_x
+            past_y[cars] = center_y
+
+        # Car.is_idle compares Vector2s, equal within their epsilon
+        idle = (np.abs(last_x[cars] - center_x) < vehicle.ROTATION_EPSILON) & (np.abs(last_y[cars] - center_y) < vehicle.ROTATION_EPSILON)
+        if iteration % 40 == 0:
+            last_x[cars] = center_x
+            last_y[cars] = center_y
+        collided = road_matrix[center_x.astype(int), center_y.astype(int)] == constants.OFFROAD
+        punished = ~stopped & (idle | collided)
+        punishment[cars[punished]] = 150
+        running[cars[stopped | punished]] = False
+        if bound is not None:
+            cut = ~stopped & ~punished & (fitness_lower_bound(left_right[cars]) > bound)
+            pruned[cars[cut]] = True
+            running[cars[cut]] = False
+
+    simulated_steps += int(iterations.sum())
+    fitness = (left_right/iterations + punishment).tolist()
+    for i in np.flatnonzero(pruned):
+        fitness[i] = Pruned(fitness_lower_bound(left_right[i]), int(MAX_ITERATIONS + 1 - iterations[i]))
+    return fitness
+
+class BatchEvaluator:
+    """
+    Fitness of (FSAngle, FSVelocity) pairs, simulated in lockstep by evaluate_batch. Without a field
+    the sensors go through a CanonicalSensorCache, as in a SerialEvaluator. self.steps counts the
+    simulation steps of all cars
+    """
+    def __init__(self, road_matrix, field = None):
+        self.road_matrix = road_matrix
+        self.field = field
+        self.cache = CanonicalSensorCache(road_matrix) if field is None else None
+        self.steps = 0
+
+    def __call__(self, systems, bound = None):
+        steps = simulated_steps
+        result = evaluate_batch(list(systems), self.road_matrix, self.field, bound, self.cache)
+        self.steps += simulated_steps - steps
+        return result
+
+    def close(self):
+        return
+
+class SerialEvaluator:
+    """
+    Fitness of (FSAngle, FSVelocity) pairs, one after the other in this process. By default the
+    sensors go through a CanonicalSensorCache, so the fitness equals that of a PoolEvaluator.
+    self.steps counts the simulation steps, self.busy_time the seconds spent evaluating
+    """
+    def __init__(self, road_matrix, cache = None, field = None):
+        self.road_matrix = road_matrix
+        self.cache = cache if cache is not None else CanonicalSensorCache(road_matrix)
+        self.field = field
+        self.workers = 1
+        self.steps = 0
+        self.busy_time = 0.0
+
+    def __call__(self, systems, bound = None):
+        steps = simulated_steps
+        start = time.perf_counter()
+        result = [evaluate(FSAngle, FSVelocity, self.road_matrix, self.cache, self.field, bound) for FSAngle, FSVelocity in systems]
+        self.busy_time += time.perf_counter() - start
+        self.steps += simulated_steps - steps
+        return result
+
+    def submit(self, systems, bound = None):
+        """Evaluates one pair right away, as a finished Future (see PoolEvaluator.submit)"""
+        future = Future()
+        future.set_result(self([systems], bound)[0])
+        return future
+
+    def result(self, future):
+        return future.result()
+
+    def close(self):
+        return
+
+# Road matrix, cache and field of a pool worker process, set once by init_worker
+worker_state = None
+
+def init_worker(road_matrix, cache, field):
+    global worker_state
+    worker_state = (road_matrix, cache, field)
+
+def evaluate_in_worker(systems, bound = None):
+    # Fitness, cache hits and misses, simulation steps and the seconds spent evaluating
+    road_matrix, cache, field = worker_state
+    hits, misses, steps = cache.hits, cache.misses, simulated_steps
+    start = time.perf_counter()
+    fitness = evaluate(systems[0], systems[1], road_matrix, cache, field, bound)
+    return fitness, cache.hits - hits, cache.misses - misses, simulated_steps - steps, time.perf_counter() - start
+
+class PoolEvaluator:
+    """
+    Fitness of (FSAngle, FSVelocity) pairs on a pool of worker processes.
+    Workers get the road matrix once, at start. By default they share one SharedSensorCache,
+    whose slots do not depend on evaluation order, so the fitness values are the same for
+    any number of workers. With a field, or when the shared block does not fit in
+    SHARED_MEMORY_PATH, every worker gets its own copy of a CanonicalSensorCache instead,
+    which gives the same readings. Hits and misses of the workers are added to self.cache,
+    their simulation steps to self.steps and their evaluation time to self.busy_time.
+    """
+    def __init__(self, road_matrix, workers, cache = None, field = None):
+        self.owns_cache = cache is None and field is None and SharedSensorCache.fits(road_matrix)
+        if self.owns_cache:
+            cache = SharedSensorCache(road_matrix)
+        self.cache = cache if cache is not None else CanonicalSensorCache(road_matrix)
+        self.workers = workers
+        self.steps = 0
+        self.busy_time = 0.0
+        self.executor = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(road_matrix, self.cache, field))
+
+    def __call__(self, systems, bound = None):
+        systems = list(systems)
+        chunksize = max(1, len(systems) // (self.workers * 4))
+        result = []
+        for worker_result in self.executor.map(evaluate_in_worker, systems, [bound]*len(systems), chunksize=chunksize):
+            result.append(self.collect(worker_result))
+        return result
+
+    def submit(self, systems, bound = None):
+        """Future of the evaluation of one (FSAngle, FSVelocity) pair, its fitness comes from result"""
+        return self.executor.submit(evaluate_in_worker, systems, bound)
+
+    def result(self, future):
+        return self.collect(future.result())
+
+    def collect(self, worker_result):
+        fitness, hits, misses, steps, busy_time = worker_result
+        self.cache.hits += hits
+        self.cache.misses += misses
+        self.steps += steps
+        self.busy_time += busy_time
+        return fitness
+
+    def close(self):
+        self.executor.shutdown()
+        if self.owns_cache:
+            self.cache.close()
+
+def worker_utilization(evaluator, wall_time):
+    """Share of the worker time spent evaluating, None for evaluators without workers"""
+    if not hasattr(evaluator, 'busy_time') or wall_time <= 0:
+        return None
+    return evaluator.busy_time / (evaluator.workers * wall_time)
+
+def make_evaluator(road_matrix, workers = 1, field = None, batch = False):
+    """BatchEvaluator when batch is set, SerialEvaluator for one worker, PoolEvaluator otherwise"""
+    if batch:
+        return BatchEvaluator(road_matrix, field)
+    if workers > 1:
+        return PoolEvaluator(road_matrix, workers, field=field)
+    return SerialEvaluator(road_matrix, field=field)
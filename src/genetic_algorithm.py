@@ -1,18 +1,22 @@
 import fuzzy_generator
+import genome
 from simulation import Simulation
 import numpy as np
-import copy
 import random
 import ga_fitness
+import sensor_field
 from utils import load_path as lp
 from utils import constants, path_generator
 import os
 import pickle # Rick
 import argparse
-
-path = None
-path_is_closed = None
-road_matrix = None
+import csv
+import json
+import time
+from datetime import datetime
+import queue
+import multiprocessing
+from concurrent.futures import wait, FIRST_COMPLETED
 
 TOURNAMENT_SIZE = 5
 POPULATION_SIZE = 1000 # Must be even
@@ -21,25 +25,150 @@ MAX_ITERATIONS = 20
 MUTATION_SPAN = 2
 MUTATION_RATE = 0.1
 MUTATION_GENOM_RATE = 0.1
+WORKERS = 1 # Fitness evaluation processes, see ga_fitness.make_evaluator
+BATCH = False # Lockstep simulation of the whole generation (ga_fitness.BatchEvaluator)
+SELECTION = 'tournament' # Parent selection of genome.SELECTIONS: 'tournament', 'roulette' or 'rank'
+STEADY_STATE = False # Children replace the worst chromosome as their evaluations finish (optimize_steady_state)
+ISLANDS = 1 # Subpopulations evolved in their own processes, see optimize_islands
+MIGRATION_INTERVAL = 5 # Generations between two migrations of the islands
+MIGRANTS = 2 # Best chromosomes an island sends per migration
+TOPOLOGY = 'ring' # Migration targets, one of TOPOLOGIES
+TOPOLOGIES = ('ring', 'random') # island i sends to i+1 / to its successor on a new random ring every migration
+CHECKPOINT_INTERVAL = 5 # Generations between two checkpoints of a run with a checkpoint file
+# Early stopping, a criterion set to None is off (see EarlyStopping)
+STAGNATION_GENERATIONS = None # Generations without a better best fitness
+VARIANCE_FLOOR = None # Population fitness variance of a converged population
+TIME_BUDGET = None # Seconds of training
+EVALUATION_BUDGET = None # Fitness evaluations (simulations) of the run
+PRUNE = None # Early abort bound of the children: 'elite' (worst elite fitness), a population percentile or None
+# Per-generation pruning reports, one timestamped CSV per run (export_pruning)
+PRUNING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'pruning')
+
+class GAConfig:
+    # Hyperparameters of one GA run, the module constants are the defaults
+    FIELDS = ('population_size', 'max_iterations', 'elitism_ratio', 'tournament_size', 'mutation_rate',
+              'mutation_span', 'mutation_genom_rate', 'selection', 'workers', 'batch', 'steady_state', 'islands', 'migration_interval', 'migrants', 'topology',
+              'checkpoint_interval', 'stagnation_generations', 'variance_floor', 'time_budget', 'evaluation_budget',
+              'prune', 'seed')
+
+    def __init__(self, population_size = POPULATION_SIZE, max_iterations = MAX_ITERATIONS, elitism_ratio = ELITISM_RATIO,
+                 tournament_size = TOURNAMENT_SIZE, mutation_rate = MUTATION_RATE, mutation_span = MUTATION_SPAN,
+                 mutation_genom_rate = MUTATION_GENOM_RATE, selection = SELECTION, workers = WORKERS, batch = BATCH,
+                 steady_state = STEADY_STATE, islands = ISLANDS, migration_interval = MIGRATION_INTERVAL, migrants = MIGRANTS,
+                 topology = TOPOLOGY, checkpoint_interval = CHECKPOINT_INTERVAL, stagnation_generations = STAGNATION_GENERATIONS,
+                 variance_floor = VARIANCE_FLOOR, time_budget = TIME_BUDGET, evaluation_budget = EVALUATION_BUDGET,
+                 prune = PRUNE, seed = None):
+        self.population_size = population_size
+        self.max_iterations = max_iterations
+        self.elitism_ratio = elitism_ratio
+        self.tournament_size = tournament_size
+        self.mutation_rate = mutation_rate
+        self.mutation_span = mutation_span
+        self.mutation_genom_rate = mutation_genom_rate
+        self.selection = selection
+        self.workers = workers
+        self.batch = batch
+        self.steady_state = steady_state
+        self.islands = islands
+        self.migration_interval = migration_interval
+        self.migrants = migrants
+        self.topology = topology
+        self.checkpoint_interval = checkpoint_interval
+        self.stagnation_generations = stagnation_generations
+        self.variance_floor = variance_floor
+        self.time_budget = time_budget
+        self.evaluation_budget = evaluation_budget
+        self.prune = prune
+        self.seed = seed
+
+    @classmethod
+    def from_dict(cls, config):
+        # Strategy dicts of the benchmarks, keys like name or num_trainings are ignored
+        return cls(**{key: value for key, value in config.items() if key in cls.FIELDS})
+
+    def replace(self, **changes):
+        # Copy of the config with some fields changed
+        values = {key: getattr(self, key) for key in self.FIELDS}
+        values.update(changes)
+        return GAConfig(**values)
 
-def swap(a, b):
-    tmp = a
-    a = b
-    b = tmp
-    return a, b
-
-memory = {}
+    def __str__(self):
+        return ', '.join('{}: {}'.format(key, getattr(self, key)) for key in self.FIELDS)
+
+class GARun:
+    # State of one GA run: its config, random sources, road, fitness evaluator and fitness cache.
+    # Runs share nothing, so several strategies can be trained side by side in one process.
+    # A run given an evaluator (e.g. one ga_fitness.PoolEvaluator for all strategies) leaves it open on close.
+    # With a checkpoint file, the run resumes from it and writes it as it goes (resume_population, end_generation)
+    def __init__(self, config, road_matrix, field = None, evaluator = None, checkpoint = None):
+        self.config = config
+        self.checkpoint = checkpoint
+        # random.Random draws the random fuzzy systems, the Generator selection and the genome operators
+        self.random = random.Random(config.seed)
+        self.rng = np.random.default_rng(config.seed)
+        self.road_matrix = road_matrix
+        # sensor_field.SensorField of road_matrix, exact ray marching when None
+        self.field = field
+        self.owns_evaluator = evaluator is None
+        if evaluator is None:
+            evaluator = ga_fitness.make_evaluator(road_matrix, config.workers, field, config.batch)
+        self.evaluator = evaluator
+        self.fitness_cache = ga_fitness.FitnessCache()
+        # Share of the worker time spent evaluating, set by optimize
+        self.utilization = None
+        # Fitness evaluations run so far, completed generations and why the run stopped (EarlyStopping)
+        self.evaluations = 0
+        self.generations = 0
+        self.stop_reason = None
+
+    def close(self):
+        if self.owns_evaluator:
+            self.evaluator.close()
 
 class Chromosome:
-    def __init__(self):
-        self.FSAngle, self.FSVelocity = fuzzy_generator.build_random_fuzzy_system()
-        self.fitness = self.get_fitness()
-        
-    def get_fitness(self):
-        return ga_fitness.evaluate(self.FSAngle, self.FSVelocity, road_matrix, memory)
+    # A chromosome is pending (fitness None) until evaluate_population scores it. Its fuzzy
+    # systems are decoded from the genome on first use, so chromosomes whose fitness comes
+    # from a FitnessCache are never decoded
+    def __init__(self, rand = random):
+        # Random chromosome
+        self.systems = fuzzy_generator.build_random_fuzzy_system(rand)
+        self.genome = genome.encode(*self.systems)
+        self.fitness = None
+
+    @classmethod
+    def from_genome(cls, genes, fitness = None):
+        # Chromosome of an existing genome vector, without decoding or evaluating it
+        c = cls.__new__(cls)
+        c.set_genome(genes)
+        c.fitness = fitness
+        return c
+
+    def set_genome(self, genes):
+        # New genes make the chromosome pending again
+        self.genome = genes
+        self.systems = None
+        self.fitness = None
+
+    @property
+    def FSAngle(self):
+        return self.get_systems()[0]
 
-    def update_fitness(self):
-        self.fitness = self.get_fitness()
+    @property
+    def FSVelocity(self):
+        return self.get_systems()[1]
+
+    def get_systems(self):
+        if self.systems is None:
+            self.systems = genome.decode(self.genome)
+        return self.systems
+
+    @property
+    def pending(self):
+        return self.fitness is None
+
+    def copy(self):
+        # Independent chromosome with the same genes and fitness, decoded again on demand
+        return Chromosome.from_genome(self.genome.copy(), self.fitness)
 
     def __lt__(self, other):
         return self.fitness < other.fitness
@@ -56,119 +185,139 @@ class Chromosome:
         with open(constants.PRETRAINED_FUZZY_PATH, 'wb') as f:
             pickle.dump([self.FSAngle, self.FSVelocity], f)
 
-def init_population(size): 
+def evaluate_population(chromosomes, run, bound = None):
+    # Scores the pending chromosomes in one call of the run's evaluator, so a PoolEvaluator spreads them over
+    # its workers and a BatchEvaluator simulates them together. Already scored ones (elites) are kept.
+    # Runs that can no longer beat bound stop early with a ga_fitness.Pruned fitness.
+    # Genomes in the run's ga_fitness.FitnessCache (or twice in chromosomes) are not simulated again
+    fitness_cache = run.fitness_cache
+    todo = {}
+    for c in chromosomes:
+        if not c.pending:
+            continue
+        key = genome.genome_hash(c.genome)
+        if key in todo:
+            fitness_cache.hits += 1
+            todo[key].append(c)
+            continue
+        value = fitness_cache.get(key)
+        if value is None:
+            todo[key] = [c]
+        else:
+            c.fitness = value
+
+    if not todo:
+        return [c.fitness for c in chromosomes]
+    run.evaluations += len(todo)
+    fitness = run.evaluator([(copies[0].FSAngle, copies[0].FSVelocity) for copies in todo.values()], bound)
+    for (key, copies), value in zip(todo.items(), fitness):
+        for c in copies:
+            c.fitness = value
+        fitness_cache.put(key, value)
+    return [c.fitness for c in chromosomes]
+
+def init_population(run):
+    # Pending random chromosomes, scored by evaluate_population
     population = []
-    for i in range(size):
-        population.append(Chromosome())
+    for i in range(run.config.population_size):
+        population.append(Chromosome(run.random))
     return np.array(population)
 
-def get_best_chromosome(population):
-    result = None
-    for chromosome in population:
-        if result == None or chromosome < result:
-            result = copy.deepcopy(chromosome)
-    return result
+def population_fitness(population):
+    return np.array([c.fitness for c in population], dtype=float)
 
-def create_group(population, group_size = TOURNAMENT_SIZE):
-    ids = random.sample(range(0, population.size), group_size)
-    return population[ids]
+def elite_indices(fitness, elites):
+    # Indices of the elites lowest fitness values, best first, without sorting the whole population
+    elites = min(elites, fitness.size)
+    if elites <= 0:
+        return np.empty(0, dtype=int)
+    ids = np.argpartition(fitness, elites - 1)[:elites]
+    return ids[np.argsort(fitness[ids], kind='stable')]
 
-def select(population):
-    # tournament selection
-    group = create_group(population)
-    result = group[0]
-    for i in range(1, group.size):
-        if group[i] < result:
-            result = group[i]
-    return result
-
-def crossover(p1, p2):
-    c1 = copy.deepcopy(p1)
-    c2 = copy.deepcopy(p2)
-    for i in range(c1.FSAngle.inputs.size):
-        fuzzy_output1 = c1.FSAngle.inputs[i]
-        fuzzy_output2 = c2.FSAngle.inputs[i]
+def elite_count(population, config):
+    return int(len(population) * config.elitism_ratio)
 
-        for j in range(fuzzy_output1.inputs.size):
-            mf_output1 = fuzzy_output1[j]
-            mf_output2 = fuzzy_output2[j]
+def get_elites(population, config, fitness = None):
+    # Best elite_count chromosomes of a scored population, best first
+    if fitness is None:
+        fitness = population_fitness(population)
+    return [population[i] for i in elite_indices(fitness, elite_count(population, config))]
 
-            r = random.random()
-            if r < 0.5:
-                swap(mf_output1, mf_output2)
+def get_best_chromosome(population):
+    # Best chromosome of a scored population (not a copy, see Chromosome.copy). ga_fitness.Pruned values are
+    # only lower bounds, so they are skipped unless no chromosome has an exact fitness
+    fitness = population_fitness(population)
+    pruned = np.array([isinstance(c.fitness, ga_fitness.Pruned) for c in population])
+    if not pruned.all():
+        fitness[pruned] = np.inf
+    return population[int(np.argmin(fitness))]
+
+def best_result(population, run):
+    # Copy of the best chromosome with an exact fitness, evaluated again without a bound if it was pruned
+    result = get_best_chromosome(population).copy()
+    if isinstance(result.fitness, ga_fitness.Pruned):
+        result.fitness = None
+        evaluate_population([result], run)
+    return result
 
-    for i in range(c1.FSVelocity.inputs.size):
-        fuzzy_output1 = c1.FSVelocity.inputs[i]
-        fuzzy_output2 = c2.FSVelocity.inputs[i]
+def select_parents(population, run, n, fitness = None):
+    # n parents of a scored population in one draw over its fitness array (config.selection of genome.SELECTIONS)
+    if fitness is None:
+        fitness = population_fitness(population)
+    config = run.config
+    ids = genome.SELECTIONS[config.selection](fitness, n, config.tournament_size, run.rng)
+    return population[ids]
 
-        for j in range(fuzzy_output1.inputs.size):
-            mf_output1 = fuzzy_output1[j]
-            mf_output2 = fuzzy_output2[j]
+def select(population, run):
+    # One parent, prefer select_parents for a whole generation
+    return select_parents(population, run, 1)[0]
 
-            r = random.random()
-            if r < 0.5:
-                swap(mf_output1, mf_output2)
-                
-    return c1, c2
+def crossover(p1, p2, run):
+    # Uniform crossover of the input MFs, the children are pending
+    g1, g2 = genome.crossover(p1.genome[np.newaxis], p2.genome[np.newaxis], run.rng)
+    return Chromosome.from_genome(g1[0]), Chromosome.from_genome(g2[0])
 
-def mutate(c, mutation_rate = MUTATION_RATE):
-    r = random.random()
-    if r > mutation_rate:
-        return c
-
-    for i in range(c.FSAngle.inputs.size):
-        fuzzy_input = c.FSAngle.inputs[i]
-        for j in range(fuzzy_input.inputs.size):
-            mf_input = fuzzy_input[j]
-            for k in range(fuzzy_input.inputs[j].size):
-                
-                r = random.random()
-                if r < MUTATION_GENOM_RATE:
-                    number_of_points = int(mf_input.size)
-                    right_boundary = fuzzy_generator.ALL_FUZZY_FUNCS[fuzzy_input.name]["right_boundary"]
-                    left_boundary = fuzzy_generator.ALL_FUZZY_FUNCS[fuzzy_input.name]["left_boundary"]
-
-                    shift_value = random.randint(-MUTATION_SPAN, MUTATION_SPAN)
-
-                    if number_of_points == 2 and mf_input.points[0][1] == 1:
-                        new_value = mf_input.points[0][0] + shift_value
-                        mf_input.points[0][0] = min(right_boundary, new_value)
-
-                    elif number_of_points == 2 and mf_input.points[0][1] == 0:
-                        new_value = mf_input.points[1][0] + shift_value
-                        mf_input.points[1][0] = max(left_boundary, new_value)
-
-                    else:
-                        left = mf_input.points[0][0] + shift_value
-                        shift_value = random.randint(-MUTATION_SPAN, MUTATION_SPAN)
-                        right = mf_input.points[-1][0] + shift_value
-
-                        if left < left_boundary:
-                            left = left_boundary
-                        
-                        if right > right_boundary:
-                            right = right_boundary
-                        
-                        if left > right:
-                            swap(left, right_boundary)
-
-                        if abs(left - right) <= 2:
-                            right += 2 
-
-                        mid_1 = mf_input.points[1][0] + shift_value
-                        shift_value = random.randint(-MUTATION_SPAN, MUTATION_SPAN)
-                        mid_2 = mf_input.points[2][0] + shift_value
-                        
-                        if mid_1 > mid_2:
-                            mid_1, mid2 = swap(mid_1, mid_2)
-
-                        new_xs = [left, mid_1, mid_2, right]
-
-                        for t in range(4):
-                            mf_input.points[t][0] = new_xs[t]
+def mutate(c, run):
+    config = run.config
+    genes = genome.mutate(c.genome[np.newaxis], config.mutation_rate, config.mutation_genom_rate, config.mutation_span, run.rng)[0]
+    if not np.array_equal(genes, c.genome):
+        c.set_genome(genes)
     return c
+
+def breed_children(population, run, fitness = None):
+    # Two pending children of a scored population
+    p1, p2 = select_parents(population, run, 2, fitness)
+    c1, c2 = crossover(p1, p2, run)
+    return mutate(c1, run), mutate(c2, run)
+
+def selection_bound(fitness, config):
+    # Fitness a child has to beat to be worth an exact value: the worst elite ('elite')
+    # or a percentile of the population fitness array
+    if config.prune is None:
+        return None
+    if config.prune == 'elite':
+        # Same count as get_elites, without elites there is nothing to beat
+        k = elite_count(fitness, config) - 1
+        if k < 0:
+            return None
+        return float(np.partition(fitness, k)[k])
+    return float(np.percentile(fitness, float(config.prune)))
+
+def next_generation(population, run, fitness = None):
+    # Elites of a scored population plus pending children bred on the (P, GENOME_SIZE) genome matrix
+    config = run.config
+    if fitness is None:
+        fitness = population_fitness(population)
+    new_population = get_elites(population, config, fitness)
+    genomes = np.array([c.genome for c in population])
+    children = genome.offspring(genomes, fitness, (config.population_size-len(new_population))//2, config.tournament_size,
+                                config.mutation_rate, config.mutation_genom_rate, config.mutation_span, run.rng,
+                                config.selection)
+
+    offspring = [Chromosome.from_genome(genes) for genes in children]
+    return np.array(new_population + offspring)
                 
-def run_game(result):
+def run_game(result, path, path_is_closed):
     os.environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % constants.SCREEN_POSITION
     game = Simulation(path, path_is_closed)
     game.run(result.FSAngle, result.FSVelocity)
@@ -184,46 +333,392 @@ def load_initial_params(is_sin_path):
 
     return path, path_is_closed, road_matrix
 
-def optimize(size = POPULATION_SIZE, max_iteration = MAX_ITERATIONS, elitism_ratio = ELITISM_RATIO):
+def pruning_report(stats, bound, generation_time, steps):
+    # Row of export_pruning for one generation. The skipped steps are priced at the generation's
+    # measured seconds per simulated step, None when the evaluator does not count its steps
+    step_time = generation_time / steps if steps else None
+    time_saved = stats['skipped_steps'] * step_time if step_time is not None else None
+    return dict(bound=bound, generation_time=generation_time, simulated_steps=steps,
+                step_time=step_time, time_saved=time_saved, **stats)
+
+def export_pruning(rows, filename = None):
+    # Writes the pruning rows of a run to filename, by default a new file in PRUNING_DIR, and returns it
+    if filename is None:
+        filename = os.path.join(PRUNING_DIR, 'pruning_{}_{}.csv'.format(datetime.now().strftime('%Y%m%d_%H%M%S_%f'), os.getpid()))
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    return filename
+
+def save_checkpoint(run, population, generation, stopping = None):
+    # Writes the state of a run after generation: genomes, fitness, random sources, fitness and
+    # sensor cache contents and the EarlyStopping state. Written next to the checkpoint and renamed,
+    # so a crash never leaves half a file
+    arrays = dict(
+        config=np.array(str(run.config)),
+        generation=np.array(generation),
+        evaluations=np.array(run.evaluations),
+        stop_reason=np.array(run.stop_reason or ''),
+        genomes=np.array([c.genome for c in population]),
+        fitness=population_fitness(population),
+        # ga_fitness.Pruned lower bounds, -1 for exact fitness
+        skipped_steps=np.array([c.fitness.skipped_steps if isinstance(c.fitness, ga_fitness.Pruned) else -1 for c in population]),
+        rng_state=np.array(json.dumps(run.rng.bit_generator.state)),
+        random_state=np.array(json.dumps(run.random.getstate())),
+        **run.fitness_cache.contents())
+    if run.evaluator.cache is not None:
+        arrays.update(run.evaluator.cache.contents())
+    if stopping is not None:
+        arrays.update(stopping.contents())
+
+    os.makedirs(os.path.dirname(os.path.abspath(run.checkpoint)), exist_ok=True)
+    temporary = run.checkpoint + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, run.checkpoint)
+
+def load_checkpoint(run, stopping = None):
+    # (population, generation) of the run's checkpoint, with its random sources, caches and stopping state
+    # restored. The chromosomes keep their fitness, so they are not evaluated again
+    with np.load(run.checkpoint) as checkpoint:
+        contents = dict(checkpoint)
+    run.rng.bit_generator.state = json.loads(str(contents['rng_state']))
+    version, state, gauss = json.loads(str(contents['random_state']))
+    run.random.setstate((version, tuple(state), gauss))
+    run.fitness_cache.restore(contents)
+    if run.evaluator.cache is not None:
+        run.evaluator.cache.restore(contents)
+    if stopping is not None:
+        stopping.restore(contents)
+    run.evaluations = int(contents['evaluations'])
+    run.generations = int(contents['generation'])
+    run.stop_reason = str(contents['stop_reason']) or None
+    fitness = contents['fitness'].tolist()
+    if 'skipped_steps' in contents:
+        fitness = [value if skipped < 0 else ga_fitness.Pruned(value, skipped)
+                   for value, skipped in zip(fitness, contents['skipped_steps'].tolist())]
+    population = [Chromosome.from_genome(genes, value) for genes, value in zip(contents['genomes'], fitness)]
+    return np.array(population), run.generations
+
+def resume_population(run, stopping = None):
+    # Scored population and the generation to continue from: from the run's checkpoint when it has one
+    # of the same config (max_iterations once that run had stopped), else a new population at generation 0.
+    # stopping continues from the checkpoint's state or starts from the new population's best fitness
+    if run.checkpoint is not None and os.path.exists(run.checkpoint):
+        with np.load(run.checkpoint) as checkpoint:
+            same_config = str(checkpoint['config']) == str(run.config)
+        if same_config:
+            population, generation = load_checkpoint(run, stopping)
+            print('Resumed generation {} from {}'.format(generation, run.checkpoint))
+            if run.stop_reason is not None:
+                return population, run.config.max_iterations
+            return population, generation
+        print('Ignoring checkpoint of another config: {}'.format(run.checkpoint))
+    population = init_population(run)
+    evaluate_population(population, run)
+    if stopping is not None:
+        stopping.best = float(population_fitness(population).min())
+    return population, 0
+
+class EarlyStopping:
+    # Stopping criteria of a run's GAConfig, checked after every generation: max_iterations,
+    # stagnation_generations without a better best fitness, a population fitness variance at or below
+    # variance_floor, time_budget seconds since the criteria were created, evaluation_budget evaluations.
+    # Created before resume_population, so the time budget includes the initial population and the
+    # state of a resumed run comes from its checkpoint
+    def __init__(self, run):
+        self.config = run.config
+        self.start = time.time()
+        self.best = float('inf')
+        self.stale = 0
+
+    def contents(self):
+        """Best fitness, generations without improvement and seconds used as arrays for a checkpoint"""
+        return {
+            'stopping_best': np.array(self.best),
+            'stopping_stale': np.array(self.stale),
+            'stopping_elapsed': np.array(time.time() - self.start),
+        }
+
+    def restore(self, contents):
+        """State of contents, ignored when they come from a checkpoint without it"""
+        if 'stopping_best' not in contents:
+            return
+        self.best = float(contents['stopping_best'])
+        self.stale = int(contents['stopping_stale'])
+        self.start = time.time() - float(contents['stopping_elapsed'])
+
+    def check(self, run, fitness, generation):
+        # Reason to stop after generation, None to go on
+        config = self.config
+        best = float(fitness.min())
+        if best < self.best:
+            self.best = best
+            self.stale = 0
+        else:
+            self.stale += 1
+
+        if generation >= config.max_iterations:
+            return 'max_iterations'
+        if config.stagnation_generations is not None and self.stale >= config.stagnation_generations:
+            return 'stagnation'
+        if config.variance_floor is not None and float(np.var(fitness)) <= config.variance_floor:
+            return 'variance_floor'
+        if config.time_budget is not None and time.time() - self.start >= config.time_budget:
+            return 'time_budget'
+        if config.evaluation_budget is not None and run.evaluations >= config.evaluation_budget:
+            return 'evaluation_budget'
+        return None
+
+def end_generation(run, stopping, population, generation):
+    # Bookkeeping after a generation: checks the stopping criteria and saves the checkpoint every
+    # checkpoint_interval generations and when the run stops. True when the run stops
+    run.generations = generation
+    run.stop_reason = stopping.check(run, population_fitness(population), generation)
+    if run.checkpoint is not None and (run.stop_reason is not None or generation % run.config.checkpoint_interval == 0):
+        save_checkpoint(run, population, generation, stopping)
+    return run.stop_reason is not None
+
+def report_utilization(run, wall_time):
+    # Worker utilization after the initial population, kept in run.utilization
+    run.utilization = ga_fitness.worker_utilization(run.evaluator, wall_time)
+    if run.utilization is not None:
+        print('Worker utilization: {:.1%} ({} workers, {:.2f}s)'.format(run.utilization, run.evaluator.workers, wall_time))
+
+def optimize_steady_state(run):
+    # Steady-state GA: an idle worker gets the next child bred from the current population and a
+    # finished child replaces the worst chromosome if it is better, so no worker waits for the slowest
+    # simulation of a generation. Runs as many evaluations as max_iterations generations.
+    # With config.prune, a child stops once it cannot beat the worst chromosome at submission
+    print("Starting steady state optimization!")
+
+    config = run.config
+    evaluator = run.evaluator
+    fitness_cache = run.fitness_cache
+    if not hasattr(evaluator, 'submit'):
+        raise ValueError('Steady state needs a serial or pool evaluator')
+    population = init_population(run)
+    evaluate_population(population, run)
+    fitness = population_fitness(population)
+    print('Initialized population.')
+
+    generation_size = config.population_size - elite_count(population, config)
+    budget = config.max_iterations * generation_size
+    # One queued evaluation per worker besides the running ones, so a worker never waits for breeding
+    depth = 2 * evaluator.workers
+    in_flight = {}
+    children = []
+    arrived = []
+    submitted = done = replaced = 0
+    evaluator.busy_time = 0.0
+    start = time.time()
+    while done < budget:
+        while submitted < budget and len(in_flight) < depth:
+            if not children:
+                children.extend(breed_children(population, run, fitness))
+            child = children.pop(0)
+            submitted += 1
+            key = genome.genome_hash(child.genome)
+            child.fitness = fitness_cache.get(key)
+            if not child.pending:
+                arrived.append(child)
+                continue
+            bound = float(fitness.max()) if config.prune is not None else None
+            in_flight[evaluator.submit((child.FSAngle, child.FSVelocity), bound)] = (child, key)
+
+        if not arrived:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                child, key = in_flight.pop(future)
+                child.fitness = evaluator.result(future)
+                fitness_cache.put(key, child.fitness)
+                arrived.append(child)
+
+        for child in arrived:
+            done += 1
+            worst = int(np.argmax(fitness))
+            if child.fitness < fitness[worst]:
+                population[worst] = child
+                fitness[worst] = child.fitness
+                replaced += 1
+            if done % generation_size == 0:
+                print('Evaluations: %6d' % done)
+                print('\tFitness: {}'.format(fitness.min()))
+                print('\tReplaced: {}/{}'.format(replaced, done))
+                print('\tFitness cache: {}'.format(fitness_cache))
+        arrived = []
+
+    report_utilization(run, time.time() - start)
+    result = best_result(population, run)
+    print('Finished optimization!')
+    print('Best solution fitness: {}'.format(result.fitness))
+    return result
+
+def optimize(run):
+    # Runs the GA of a GARun and returns its best chromosome
+    config = run.config
+    if config.steady_state:
+        return optimize_steady_state(run)
     print("Starting optimization!")
 
-    population = init_population(size)
+    evaluator = run.evaluator
+    fitness_cache = run.fitness_cache
+    stopping = EarlyStopping(run)
+    population, completed = resume_population(run, stopping)
     print('Initialized population.')
     
-    for iteration in range(max_iteration):
+    pruning = []
+    if hasattr(evaluator, 'busy_time'):
+        evaluator.busy_time = 0.0
+    run_start = time.time()
+    for iteration in range(completed, config.max_iterations):
         print('Current iteration: %3d' % iteration)
-        population.sort()
-        elites = int(population.size * elitism_ratio)
-        new_population = [population[i] for i in range(0, elites)]
-
-        for i in range((size-elites)//2):
-            p1 = select(population)
-            p2 = select(population)
-            c1, c2 = crossover(p1, p2)
-            c1 = mutate(c1)
-            c2 = mutate(c2)
-            c1.update_fitness()
-            c2.update_fitness()
-            new_population.append(c1)
-            new_population.append(c2)
-        population = np.array(new_population)
+        if evaluator.cache is not None:
+            evaluator.cache.reset_stats()
+        fitness_cache.reset_stats()
+        fitness = population_fitness(population)
+        bound = selection_bound(fitness, config)
+        start = time.time()
+        steps = getattr(evaluator, 'steps', None)
+        population = next_generation(population, run, fitness)
+        evaluate_population(population, run, bound)
+        elapsed = time.time() - start
+        if steps is not None:
+            steps = evaluator.steps - steps
         print('\tFitness: {}'.format(get_best_chromosome(population).fitness))
-
-    result = get_best_chromosome(population)
+        print('\tFitness cache: {}'.format(fitness_cache))
+        if evaluator.cache is not None:
+            print('\tSensor cache: {}'.format(evaluator.cache))
+        if bound is not None:
+            stats = ga_fitness.pruning_stats([c.fitness for c in population[elite_count(population, config):]])
+            pruning.append(dict(generation=iteration, **pruning_report(stats, bound, elapsed, steps)))
+            print('\tPruned: {pruned}/{evaluations} skipped steps: {skipped_steps} bound: {bound:.4f} time: {generation_time:.2f}s'.format(**pruning[-1]))
+            if pruning[-1]['time_saved'] is not None:
+                print('\tEstimated time saved: {:.2f}s'.format(pruning[-1]['time_saved']))
+        if end_generation(run, stopping, population, iteration + 1):
+            break
+
+    report_utilization(run, time.time() - run_start)
+    print('Stopped after {} generations: {}'.format(run.generations, run.stop_reason))
+    if pruning:
+        filename = export_pruning(pruning)
+        print('Pruning report: {}'.format(filename))
+    result = best_result(population, run)
     print('Finished optimization!')
     print('Best solution fitness: {}'.format(result.fitness))
+    return result
 
-    results_path = os.path.join(os.path.curdir, "results", "results.txt") 
-    result.save(results_path)
-
-    usr = input("Press any key to start the simulation")
-
-    run_game(result)
+def migration_targets(islands, topology, epoch, seed):
+    # Island each island sends its migrants to in a migration epoch, every island receives from exactly one.
+    # All islands draw the same random ring from (seed, epoch)
+    if topology == 'ring':
+        order = np.arange(islands)
+    elif topology == 'random':
+        order = np.random.default_rng([seed, epoch]).permutation(islands)
+    else:
+        raise ValueError('Unknown migration topology: {}'.format(topology))
+    targets = np.empty(islands, dtype=int)
+    targets[order] = np.roll(order, -1)
+    return targets
+
+def receive_migrants(population, fitness, genomes, migrant_fitness):
+    # Scored migrant genomes replace the worst chromosomes of an island, they are not evaluated again
+    worst = np.argpartition(-fitness, len(genomes) - 1)[:len(genomes)]
+    for i, genes, value in zip(worst, genomes, migrant_fitness):
+        population[i] = Chromosome.from_genome(genes, value)
+        fitness[i] = value
+
+def run_island(index, config, road_matrix, field, inboxes, results, topology_seed):
+    # Evolution loop of one island process. Every migration_interval generations it sends the genomes and
+    # fitness of its best migrants to its target inbox and waits for the migrants of its own inbox
+    run = GARun(config, road_matrix, field)
+    try:
+        population = init_population(run)
+        evaluate_population(population, run)
+        history = []
+        for generation in range(1, config.max_iterations + 1):
+            fitness = population_fitness(population)
+            population = next_generation(population, run, fitness)
+            evaluate_population(population, run, selection_bound(fitness, config))
+            fitness = population_fitness(population)
+            history.append(float(fitness.min()))
+
+            epoch, due = divmod(generation, config.migration_interval)
+            if len(inboxes) > 1 and due == 0 and generation < config.max_iterations:
+                targets = migration_targets(len(inboxes), config.topology, epoch, topology_seed)
+                best = elite_indices(fitness, config.migrants)
+                inboxes[targets[index]].put((np.array([population[i].genome for i in best]), fitness[best]))
+                receive_migrants(population, fitness, *inboxes[index].get())
+
+        best = best_result(population, run)
+        results.put((index, best.genome, float(best.fitness), history, run.fitness_cache.stats()))
+    finally:
+        run.close()
+
+def optimize_islands(config, road_matrix, field = None):
+    # Island model GA: config.islands processes evolve population_size / islands chromosomes each, with
+    # one evaluation process per island, and exchange config.migrants genomes on config.topology.
+    # Returns the best chromosome of all islands
+    islands = config.islands
+    print("Starting island optimization! {} islands of {}".format(islands, config.population_size // islands))
+
+    topology_seed = config.seed if config.seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+    inboxes = [multiprocessing.Queue() for _ in range(islands)]
+    results = multiprocessing.Queue()
+    processes = []
+    for index in range(islands):
+        island = config.replace(population_size = config.population_size // islands, workers = 1, steady_state = False,
+                                islands = 1, seed = None if config.seed is None else config.seed + index)
+        processes.append(multiprocessing.Process(target=run_island, daemon=True,
+                                                 args=(index, island, road_matrix, field, inboxes, results, topology_seed)))
+    for process in processes:
+        process.start()
+
+    finished = []
+    while len(finished) < islands:
+        try:
+            finished.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(process.exitcode not in (None, 0) for process in processes):
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError('An island process failed')
+    for process in processes:
+        process.join()
+
+    for index, _, fitness, history, cache in sorted(finished, key=lambda island: island[0]):
+        print('Island {}: best fitness {} fitness cache hit rate: {hit_rate:.1%}'.format(index, fitness, **cache))
+    _, genes, fitness, _, _ = min(finished, key=lambda island: island[2])
+    result = Chromosome.from_genome(genes, fitness)
+    print('Finished optimization!')
+    print('Best solution fitness: {}'.format(result.fitness))
+    return result
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--polygon', choices=['convex', 'sin'], help='Runs the GA on a choosen polygon', required=True)
+    parser.add_argument('--sensor-field', action='store_true', help='Reads the sensors from the precomputed field of the polygon')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Processes evaluating the fitness')
+    parser.add_argument('--batch', action='store_true', help='Simulates each generation in lockstep')
+    parser.add_argument('--selection', choices=list(genome.SELECTIONS.keys()), default=SELECTION, help='Parent selection scheme')
+    parser.add_argument('--steady-state', action='store_true', help='Replaces the worst chromosome as each child finishes, no generations')
+    parser.add_argument('--islands', type=int, default=ISLANDS, help='Subpopulations evolved in their own processes')
+    parser.add_argument('--migration-interval', type=int, default=MIGRATION_INTERVAL, help='Generations between island migrations')
+    parser.add_argument('--migrants', type=int, default=MIGRANTS, help='Best chromosomes an island sends per migration')
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=TOPOLOGY, help='Migration topology of the islands')
+    parser.add_argument('--checkpoint', help='Checkpoint file the run resumes from and saves to')
+    parser.add_argument('--checkpoint-interval', type=int, default=CHECKPOINT_INTERVAL, help='Generations between checkpoints')
+    parser.add_argument('--stagnation', type=int, help='Stops after this many generations without a better best fitness')
+    parser.add_argument('--variance-floor', type=float, help='Stops once the population fitness variance is at or below this value')
+    parser.add_argument('--time-budget', type=float, help='Stops after this many seconds')
+    parser.add_argument('--evaluation-budget', type=int, help='Stops after this many fitness evaluations')
+    parser.add_argument('--prune', help="Stops children that cannot beat the worst elite ('elite') or a population percentile (e.g. 50)")
+    parser.add_argument('--seed', type=int, help='Seeds the random fuzzy systems and the genome operators')
 
     args = parser.parse_args()
     polygon = args.polygon
@@ -234,4 +729,27 @@ if __name__ == '__main__':
         target_polygon = constants.USE_SIN_POLYGON
 
     path, path_is_closed, road_matrix = load_initial_params(target_polygon)
-    optimize()
\ No newline at end of file
+    field = None
+    if args.sensor_field:
+        field = sensor_field.SensorField.load(sensor_field.field_path(polygon), road_matrix)
+
+    config = GAConfig(selection = args.selection, workers = args.workers, batch = args.batch, steady_state = args.steady_state,
+                      islands = args.islands, migration_interval = args.migration_interval, migrants = args.migrants,
+                      topology = args.topology, checkpoint_interval = args.checkpoint_interval,
+                      stagnation_generations = args.stagnation, variance_floor = args.variance_floor, time_budget = args.time_budget,
+                      evaluation_budget = args.evaluation_budget, prune = args.prune, seed = args.seed)
+    if config.islands > 1:
+        result = optimize_islands(config, road_matrix, field)
+    else:
+        run = GARun(config, road_matrix, field, checkpoint = args.checkpoint)
+        try:
+            result = optimize(run)
+        finally:
+            run.close()
+
+    results_path = os.path.join(os.path.curdir, "results", "results.txt") 
+    result.save(results_path)
+
+    usr = input("Press any key to start the simulation")
+
+    run_game(result, path, path_is_closed)
@@ -0,0 +1,189 @@
+# Flat genome of a chromosome: the x breakpoints of every MF of fuzzy_generator.ALL_FUZZY_FUNCS
+# in one float vector of length GENOME_SIZE. The y values of a breakpoint only depend on its
+# position (get_ys), so they are not part of the genome.
+#
+# Layout: for every fuzzy io in ALL_FUZZY_FUNCS order, for every MF, its x breakpoints
+# (2 for the shoulders, 4 for the trapezoids). Input genes are evolved by the GA, output
+# genes are inherited unchanged (same as mutate/crossover on FuzzySystems).
+#
+# A population is a (P, GENOME_SIZE) matrix. Selection, uniform crossover, bounded mutation
+# and repair run as array operations on it, so a new generation needs no copy.deepcopy.
+
+import hashlib
+import numpy as np
+
+import fuzzy
+import fuzzy_generator
+
+
+def mf_sizes(func):
+    # Breakpoints per MF of one fuzzy io, same split as fuzzy_generator.xy_split
+    size = len(func["mf_names"])
+    return [2] + [4]*(size - 2) + [2]
+
+FUNC_NAMES = list(fuzzy_generator.ALL_FUZZY_FUNCS.keys())
+
+# Per gene: owning fuzzy io, owning MF (global index), y value, boundaries, evolved or not
+GENE_FUNC = []
+GENE_MF = []
+GENE_Y = []
+MF_COUNT = 0
+for f, name in enumerate(FUNC_NAMES):
+    sizes = mf_sizes(fuzzy_generator.ALL_FUZZY_FUNCS[name])
+    for size in sizes:
+        GENE_FUNC += [f]*size
+        GENE_MF += [MF_COUNT]*size
+        MF_COUNT += 1
+    GENE_Y += fuzzy_generator.get_ys(sum(sizes))
+
+GENE_FUNC = np.array(GENE_FUNC)
+GENE_MF = np.array(GENE_MF)
+GENE_Y = np.array(GENE_Y)
+GENE_LOW = np.array([fuzzy_generator.ALL_FUZZY_FUNCS[FUNC_NAMES[f]]["left_boundary"] for f in GENE_FUNC], dtype=float)
+GENE_HIGH = np.array([fuzzy_generator.ALL_FUZZY_FUNCS[FUNC_NAMES[f]]["right_boundary"] for f in GENE_FUNC], dtype=float)
+GENE_EVOLVED = np.array([fuzzy_generator.ALL_FUZZY_FUNCS[FUNC_NAMES[f]]["is_input"] for f in GENE_FUNC])
+
+GENOME_SIZE = GENE_MF.size
+# First gene of every MF, the genes of an MF are contiguous
+MF_START = np.flatnonzero(np.diff(GENE_MF, prepend=-1))
+
+def fuzzy_ios(FSAngle, FSVelocity):
+    # FuzzyInput / FuzzyOutput objects of a controller in genome layout order
+    ios = {fuzzy_input.name: fuzzy_input for fuzzy_input in FSAngle.inputs}
+    ios[FSAngle.output.name] = FSAngle.output
+    ios[FSVelocity.output.name] = FSVelocity.output
+    return [ios[fuzzy_generator.ALL_FUZZY_FUNCS[name]["name"]] for name in FUNC_NAMES]
+
+def encode(FSAngle, FSVelocity):
+    """
+    Genome vector of a controller (pair built by fuzzy_generator.build_random_fuzzy_system)
+    """
+    return np.concatenate([mf.points[:, 0] for io in fuzzy_ios(FSAngle, FSVelocity) for mf in io]).astype(float)
+
+def decode(genome):
+    """
+    (FSAngle, FSVelocity) of a genome vector, same structure and rules as build_random_fuzzy_system
+    """
+    fuzzy_inputs = {}
+    fuzzy_outputs = {}
+    for f, key in enumerate(FUNC_NAMES):
+        func = fuzzy_generator.ALL_FUZZY_FUNCS[key]
+        genes = GENE_FUNC == f
+        xs = genome[genes]
+        ys = GENE_Y[genes]
+        mfs = GENE_MF[genes]
+        if func["is_input"]:
+            fuzzy_inputs[func["name"]] = fuzzy.FuzzyInput(func["name"], np.array(
+                [fuzzy.MFInput(name, xs[mfs == mf], ys[mfs == mf]) for name, mf in zip(func["mf_names"], np.unique(mfs))]))
+        else:
+            fuzzy_outputs[func["name"]] = fuzzy.FuzzyOutput(func["name"], np.array(
+                [fuzzy.MFOutput(name, xs[mfs == mf], ys[mfs == mf]) for name, mf in zip(func["mf_names"], np.unique(mfs))]))
+
+    angle_rules, velocity_rules = fuzzy_generator.set_rules(fuzzy_inputs["left_sensor"], fuzzy_inputs["front_sensor"],
+                                                            fuzzy_inputs["right_sensor"], fuzzy_outputs["angle"], fuzzy_outputs["velocity"])
+
+    FSAngle = fuzzy.FuzzySystem(np.array(list(fuzzy_inputs.values())), fuzzy_outputs["angle"], angle_rules)
+    FSVelocity = fuzzy.FuzzySystem(np.array(list(fuzzy_inputs.values())), fuzzy_outputs["velocity"], velocity_rules)
+    return FSAngle, FSVelocity
+
+def genome_hash(genome):
+    # Content hash of a genome vector, equal for equal breakpoints (+ 0.0 folds -0.0 into 0.0)
+    return hashlib.blake2b((np.asarray(genome, dtype=float) + 0.0).tobytes(), digest_size=16).digest()
+
+def random_genomes(size):
+    """
+    (size, GENOME_SIZE) population of random controllers
+    """
+    return np.array([encode(*fuzzy_generator.build_random_fuzzy_system()) for _ in range(size)])
+
+def tournament_groups(size, n, group_size, rng):
+    """
+    (n, group_size) indices into a population of size, distinct within a row (like random.sample).
+    Rows with a repeated index are drawn again
+    """
+    if group_size > size:
+        raise ValueError('Tournament larger than the population')
+    groups = rng.integers(0, size, (n, group_size))
+    while True:
+        ordered = np.sort(groups, axis=1)
+        repeated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not repeated.any():
+            return groups
+        groups[repeated] = rng.integers(0, size, (repeated.sum(), group_size))
+
+def tournament(fitness, n, group_size, rng):
+    """
+    Indices of n tournament winners (lowest fitness, first of a tie), each out of group_size distinct chromosomes
+    """
+    groups = tournament_groups(fitness.size, n, group_size, rng)
+    return groups[np.arange(n), fitness[groups].argmin(axis=1)]
+
+def roulette(fitness, n, group_size, rng):
+    """
+    Indices of n fitness proportionate draws, the weight of a chromosome is its distance to the worst fitness
+    (group_size is unused)
+    """
+    weights = fitness.max() - fitness
+    if not weights.sum() > 0:
+        return rng.integers(0, fitness.size, n)
+    return rng.choice(fitness.size, n, p=weights/weights.sum())
+
+def rank(fitness, n, group_size, rng):
+    """
+    Indices of n linear ranking draws, the best of P chromosomes has weight P and the worst 1
+    (group_size is unused)
+    """
+    weights = np.empty(fitness.size)
+    weights[np.argsort(fitness, kind='stable')] = np.arange(fitness.size, 0, -1)
+    return rng.choice(fitness.size, n, p=weights/weights.sum())
+
+# Parent selection schemes, all called as select(fitness, n, group_size, rng) -> n population indices
+SELECTIONS = {
+    'tournament': tournament,
+    'roulette': roulette,
+    'rank': rank,
+}
+
+def crossover(parents1, parents2, rng):
+    """
+    Uniform crossover: every input MF of the children comes from either parent with probability 0.5
+    """
+    swap = (rng.random((len(parents1), MF_COUNT)) < 0.5)[:, GENE_MF] & GENE_EVOLVED
+    return np.where(swap, parents2, parents1), np.where(swap, parents1, parents2)
+
+def repair(genomes, mfs = None):
+    """
+    Clips the input genes to their ALL_FUZZY_FUNCS boundaries and sorts the breakpoints of the input MFs
+    selected by mfs, a (P, MF_COUNT) mask (every input MF by default). Other MFs keep their values and
+    order, unsorted trapezoids of fuzzy_generator included
+    """
+    repaired = GENE_EVOLVED if mfs is None else mfs[:, GENE_MF] & GENE_EVOLVED
+    genomes = np.where(repaired, np.clip(genomes, GENE_LOW, GENE_HIGH), genomes)
+    # MFs left alone sort by gene position, so they stay as they are
+    keys = np.where(repaired, genomes, np.arange(GENOME_SIZE))
+    order = np.lexsort((keys, np.broadcast_to(GENE_MF, genomes.shape)))
+    return np.take_along_axis(genomes, order, axis=1)
+
+def mutate(genomes, mutation_rate, genome_rate, span, rng):
+    """
+    Bounded mutation: a chromosome mutates with mutation_rate, then each of its input genes is shifted
+    by an integer in [-span, span] with genome_rate. Only the MFs with a shifted gene are repaired
+    """
+    n = len(genomes)
+    hit = (rng.random((n, 1)) < mutation_rate) & (rng.random((n, GENOME_SIZE)) < genome_rate) & GENE_EVOLVED
+    mutated = hit.any(axis=1)
+    genomes = genomes.copy()
+    shifted = genomes[mutated] + hit[mutated]*rng.integers(-span, span + 1, (mutated.sum(), GENOME_SIZE))
+    genomes[mutated] = repair(shifted, np.logical_or.reduceat(hit[mutated], MF_START, axis=1))
+    return genomes
+
+def offspring(genomes, fitness, pairs, tournament_size, mutation_rate, genome_rate, span, rng, selection = 'tournament'):
+    """
+    2*pairs children of a population: selection (SELECTIONS), uniform crossover and mutation
+    """
+    select = SELECTIONS[selection]
+    parents1 = genomes[select(fitness, pairs, tournament_size, rng)]
+    parents2 = genomes[select(fitness, pairs, tournament_size, rng)]
+    children1, children2 = crossover(parents1, parents2, rng)
+    children = np.stack([children1, children2], axis=1).reshape(2*pairs, GENOME_SIZE)
+    return mutate(children, mutation_rate, genome_rate, span, rng)